@@ -1,4 +1,6 @@
-import json, os
+from collections import OrderedDict
+import json, os, threading
+from core.persistence import persistence_service, write_atomic
 from ui.qt import pyelement
 
 class History:
@@ -6,12 +8,22 @@ class History:
 	 Collection that keeps a list of items in the order they were added
 	 They are retrieved one by one using get, adding a new item automatically resets the index to the end
 	 Amount of items stored can be limited by adding a limit argument
+	 When a file is given, changes are saved to it in the background
+	 Items are kept in an ordered dictionary so adding an item that is already in the history only moves it to the end, items must be hashable
+	 Changes are appended to a journal next to the file, which is compacted into the file every 'compact_interval' changes
 	"""
+	compact_interval = 100
+
 	def __init__(self, limit=0, file=None):
 		self._limit = max(0, limit)
-		self._history = []
+		self._history = OrderedDict()
+		self._items = None
 		self._index = 0
 		self._index_updated = self._history_updated = None
+		self._lock = threading.Lock()
+		self._journal = []
+		self._journal_size = 0
+		self._compact = True
 
 		self._file = file
 		if self._file is not None:
@@ -20,28 +32,96 @@ class History:
 			self._load_file()
 		else: self._save_file = False
 
+	@property
+	def _journal_file(self): return self._file + ".log"
+
 	def _load_file(self):
 		try:
 			with open(self._file, "r") as file: data = json.load(file)
-			self._history.extend(data["history"])
-			self._index, self._limit = data["index"], data["limit"]
-		except FileNotFoundError: self._save_file = False
+			for item in data["history"]: self._history[self._decode_item(item)] = None
+			self._index = data["index"]
+			if not self._limit: self._limit = data["limit"]
+		except FileNotFoundError:
+			self._save_file = False
+			return
+
+		# replaying changes that were already compacted into the file gives the same result, so the journal is only cleared after the file is written
+		try:
+			with open(self._journal_file, "r") as file:
+				for line in file:
+					try: self._replay(json.loads(line))
+					except (ValueError, IndexError, TypeError): print("WARNING", f"Skipping invalid entry in history journal '{self._journal_file}'")
+					else: self._journal_size += 1
+		except FileNotFoundError: pass
+		self._ensure_limit()
+		self._index = min(max(0, self._index), len(self._history))
+		self._compact = self._journal_size >= self.compact_interval
+
+	def _replay(self, entry):
+		if entry[0] == "add":
+			item = self._decode_item(entry[1])
+			self._history[item] = None
+			self._history.move_to_end(item)
+			# the index is only journaled when it moves on its own, adding an item always resets it to the end
+			self._ensure_limit()
+			self._index = len(self._history)
+		elif entry[0] == "index": self._index = int(entry[1])
+		elif entry[0] == "clear":
+			self._history.clear()
+			self._index = 0
+		else: raise ValueError(entry[0])
 
 	def _delete_file(self):
 		if self._file is not None:
-			try: os.remove(self._file)
-			except FileNotFoundError: pass
+			for file in (self._file, self._journal_file):
+				try: os.remove(file)
+				except FileNotFoundError: pass
 
 	def save(self):
-		""" Saves the current history to file, has no effect if no save file was set """
+		""" Saves all changes to file, has no effect if no save file was set """
 		if self._save_file:
-			data = {
-				"history": self._history,
-				"index": self._index,
-				"limit": self._limit
-			}
-			with open(self._file, "w") as file: json.dump(data, file)
-		else: self._delete_file()
+			with self._lock:
+				journal, self._journal = self._journal, []
+				compact = self._compact or self._journal_size + len(journal) >= self.compact_interval
+				self._compact = False
+				if compact:
+					data = {
+						"history": [self._encode_item(item) for item in self._history],
+						"index": self._index,
+						"limit": self._limit
+					}
+
+			if compact:
+				try:
+					write_atomic(self._file, json.dumps(data))
+					open(self._journal_file, "w").close()
+				except OSError:
+					self._compact = True
+					raise
+				self._journal_size = 0
+			elif journal:
+				with open(self._journal_file, "a") as file: file.write("".join(json.dumps(entry) + "\n" for entry in journal))
+				self._journal_size += len(journal)
+		else:
+			with self._lock:
+				self._journal.clear()
+				self._compact = True
+			self._delete_file()
+
+	def _encode_item(self, item):
+		""" Convert an item to the value that is written to file, override this for items that cannot be stored in json """
+		return item
+
+	def _decode_item(self, item):
+		""" Convert a value read from file back to an item """
+		return item
+
+	def _schedule_save(self, *entry):
+		""" Add a change to the journal and save it in the background, must be called while holding the lock """
+		if self._file is not None:
+			if self._save_file: self._journal.append(entry)
+			else: self._compact = True
+			persistence_service.schedule(self.save)
 
 	@property
 	def save_file(self):
@@ -51,6 +131,7 @@ class History:
 	def save_file(self, file):
 		self._delete_file()
 		self._file = file
+		self._compact = True
 		if not file: self._save_file = False
 
 	@property
@@ -60,7 +141,9 @@ class History:
 	@can_save.setter
 	def can_save(self, save):
 		if save and self._file is None: raise ValueError("Cannot save to file without setting a destination")
-		self._save_file = bool(save)
+		with self._lock:
+			if save and not self._save_file: self._compact = True
+			self._save_file = bool(save)
 
 	@property
 	def limit(self):
@@ -70,21 +153,23 @@ class History:
 	@property
 	def head(self):
 		""" The element that is currently at the bottom of the list or None if it's empty """
-		try: return self._history[0]
-		except IndexError: return None
+		try: return next(iter(self._history))
+		except StopIteration: return None
 
 	@property
 	def tail(self):
 		""" The element that is currently at the top of the list or None if it's empty """
-		try: return self._history[-1]
-		except IndexError: return None
+		try: return next(reversed(self._history))
+		except StopIteration: return None
 
-	def _ensure_limit(self):
-		if 0 < self._limit < len(self._history): self._history.pop(0)
+	def _get_items(self):
+		""" Returns the items as a list for access by index, the list is only created again after the history changed and is never modified """
+		items = self._items
+		if items is None: items = self._items = list(self._history)
+		return items
 
-	def _reset_index(self):
-		self._index = max(0, len(self._history))
-		self._call_index_update()
+	def _ensure_limit(self):
+		while 0 < self._limit < len(self._history): self._history.popitem(last=False)
 
 	def add(self, element):
 		""" Adds a new item to collection
@@ -92,14 +177,15 @@ class History:
 				- when max size is specified and the list is full, the oldest element is removed
 			Returns the new size of the collection
 		"""
-		try: self._history.remove(element)
-		except ValueError: pass
-
-		self._history.append(element)
-		self._ensure_limit()
+		with self._lock:
+			self._history[element] = None
+			self._history.move_to_end(element)
+			self._ensure_limit()
+			self._items = None
+			self._index = len(self._history)
+			self._schedule_save("add", self._encode_item(element))
 		self._call_history_update()
-		self._reset_index()
-		self.save()
+		self._call_index_update()
 		return len(self._history)
 
 	def peek_previous(self):
@@ -108,22 +194,24 @@ class History:
 		 Similar to 'get_previous' but without affecting the index
 		 Returns None if the list is empty or the bottom was reached
 		"""
-		try: return self._history[self._index - 1]
-		except IndexError: return None
+		index = self._index - 1
+		items = self._get_items()
+		return items[index] if 0 <= index < len(items) else None
 
 	def get_previous(self, default=None):
 		"""
 		 Go up one spot in the list and return this element
 		 Returns specified default value or None when the bottom was reached
 		"""
-		self._index -= 1
-		if self._index < 0:
-			self._index = 0
-			return default
-		else:
-			self._call_index_update()
-			self.save()
-			return self._history[self._index]
+		with self._lock:
+			if self._index <= 0:
+				self._index = 0
+				return default
+			self._index -= 1
+			self._schedule_save("index", self._index)
+			item = self._get_items()[self._index]
+		self._call_index_update()
+		return item
 
 	def peek_next(self):
 		"""
@@ -131,22 +219,23 @@ class History:
 		 Similar to 'get_next' but without affecting the index
 		 Returns None if the list is empty or the top was reached
 		"""
-		try: return self._history[self._index + 1]
-		except IndexError: return None
+		items = self._get_items()
+		return items[self._index + 1] if 0 <= self._index + 1 < len(items) else None
 
 	def get_next(self, default=None):
 		"""
 		 Go down one spot in the list and return this element
 		 Returns specified default value of None when the top was reached
 		"""
-		self._index += 1
-		if self._index >= len(self._history):
-			self._index = len(self._history)
-			return default
-		else:
-			self._call_index_update()
-			self.save()
-			return self._history[self._index]
+		with self._lock:
+			if self._index + 1 >= len(self._history):
+				self._index = len(self._history)
+				return default
+			self._index += 1
+			self._schedule_save("index", self._index)
+			item = self._get_items()[self._index]
+		self._call_index_update()
+		return item
 
 	@property
 	def index(self):
@@ -155,11 +244,13 @@ class History:
 
 	def clear(self):
 		""" Removes all items from history """
-		self._history.clear()
+		with self._lock:
+			self._history.clear()
+			self._items = None
+			self._index = 0
+			self._schedule_save("clear")
 		self._call_history_update()
-		self._index = 0
 		self._call_index_update()
-		self.save()
 
 	def OnIndexUpdated(self, cb):
 		"""
@@ -182,15 +273,15 @@ class History:
 
 	def _call_history_update(self):
 		if callable(self._history_updated):
-			try: self._history_updated(iter(self._history))
+			try: self._history_updated(iter(self._get_items()))
 			except Exception as e: print("ERROR", "Executing history update:", e)
 
-	def __getitem__(self, item): return self._history[item]
+	def __getitem__(self, item): return self._get_items()[item]
 	def __setitem__(self, key, value): raise ValueError("Cannot modify history directly")
 	def __delitem__(self, key): raise ValueError("Cannot delete history items directly")
 	def __len__(self): return len(self._history)
-	def __iter__(self): return iter(self._history)
-	def __str__(self): return f"History[history={self._history}, index={self._index}, limit={self._limit}]"
+	def __iter__(self): return iter(self._get_items())
+	def __str__(self): return f"History[history={self._get_items()}, index={self._index}, limit={self._limit}]"
 
 class HistoryViewer(pyelement.PyFrame):
 	def __init__(self, parent, window_id, history):
@@ -237,7 +328,7 @@ class HistoryViewer(pyelement.PyFrame):
 
 	def _on_history_update(self, new_history=None):
 		if new_history is None: new_history = iter(self._history)
-		self["history_view"].itemlist = [str(i) for i in new_history]
+		self["history_view"].set_items(list(new_history))
 
 	@property
 	def EventSelect(self): return self["history_view"].events.EventDoubleClick
\ No newline at end of file
@@ -0,0 +1,103 @@
+# Functions in this file are executed in worker processes,
+# they must not import anything from the application so the workers don't initialize any modules
+
+def is_available():
+	""" Returns True if the libraries required for reading media files are installed """
+	import importlib.util
+	return importlib.util.find_spec("mutagen") is not None
+
+def read_tags(filepath):
+	""" Returns a tuple (artist, title, album, duration, bitrate) read from given file, any value that cannot be read is None
+	 	Returns None if the file isn't a supported media file """
+	import mutagen
+	try: media = mutagen.File(filepath, easy=True)
+	except Exception: return None
+	if media is None: return None
+
+	def first(key):
+		try: return str(media[key][0])
+		except (KeyError, IndexError, TypeError, ValueError): return None
+
+	duration = getattr(media.info, "length", None)
+	bitrate = getattr(media.info, "bitrate", None)
+	return first("artist"), first("title"), first("album"), duration, bitrate
+
+# Loudness is measured on audio decoded by ffmpeg at this sample rate, the K-weighting filter coefficients below are defined for it
+SAMPLE_RATE = 48000
+# Coefficients (b, a) of the two stage K-weighting filter from ITU-R BS.1770
+K_WEIGHTING = (([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+			   ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]))
+
+def is_loudness_available():
+	""" Returns True if the libraries and programs required for measuring loudness are installed """
+	import importlib.util, shutil
+	return importlib.util.find_spec("numpy") is not None and shutil.which("ffmpeg") is not None
+
+# Decoded audio is read from ffmpeg a minute at a time (in 100ms blocks) so a long file never has to be in memory completely
+CHUNK_BLOCKS = 600
+
+def measure_loudness(filepath):
+	""" Returns the integrated loudness (in LUFS) of given file, or None if it cannot be decoded or is silent """
+	import subprocess
+	import numpy as np
+	step = SAMPLE_RATE // 10
+	chunk_size = CHUNK_BLOCKS * step * 2 * 4
+	response = _k_weighting_response(step)
+	power = []
+	try:
+		with subprocess.Popen(["ffmpeg", "-v", "error", "-nostdin", "-i", filepath, "-vn", "-f", "f32le", "-ac", "2", "-ar", str(SAMPLE_RATE), "-"],
+							  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+			try:
+				while True:
+					data = process.stdout.read(chunk_size)
+					# a chunk only falls short at the end of the file, the samples that don't fill a complete block are ignored
+					count = len(data) // (step * 2 * 4)
+					if count > 0: power.append(_block_power(np.frombuffer(data, dtype=np.float32, count=count * step * 2).reshape(-1, 2), step, response))
+					if len(data) < chunk_size: break
+			except BaseException:
+				process.kill()
+				raise
+	except OSError: return None
+	if process.returncode != 0: return None
+	return _gated_loudness(np.concatenate(power) if power else np.empty(0))
+
+def integrated_loudness(samples):
+	"""
+	 Returns the integrated loudness (in LUFS) of given numpy array with shape (samples, channels) sampled at 'SAMPLE_RATE', or None if it is silent
+	 The K-weighting filter is applied in the frequency domain to every 100ms block, which is then combined into 400ms gating blocks as described in ITU-R BS.1770
+	"""
+	import numpy as np
+	step = SAMPLE_RATE // 10
+	count = len(samples) // step
+	response = _k_weighting_response(step)
+	power = [_block_power(samples[start * step:min(start + CHUNK_BLOCKS, count) * step], step, response) for start in range(0, count, CHUNK_BLOCKS)]
+	return _gated_loudness(np.concatenate(power) if power else np.empty(0))
+
+def _k_weighting_response(step):
+	""" Returns the power response of the K-weighting filter for the frequencies of a block of 'step' samples, scaled so it gives the mean square of the block """
+	import numpy as np
+	z = np.exp(-1j * np.pi * np.fft.rfftfreq(step, 1 / SAMPLE_RATE) / (SAMPLE_RATE / 2))
+	response = np.ones(len(z))
+	for b, a in K_WEIGHTING: response *= np.abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z)) ** 2
+	# Parseval: every frequency except the first and last appears twice in the full spectrum
+	response[1:-1 if step % 2 == 0 else None] *= 2
+	response /= step * step
+	return response
+
+def _block_power(samples, step, response):
+	""" Returns the mean square of every filtered block of 'step' samples summed over all channels, the number of samples must be a multiple of 'step' """
+	import numpy as np
+	spectrum = np.abs(np.fft.rfft(samples.reshape(len(samples) // step, step, -1), axis=1)) ** 2
+	return np.einsum("bfc,f->b", spectrum, response)
+
+def _gated_loudness(power):
+	import numpy as np
+	if len(power) < 4: return None
+
+	# gating blocks of 400ms with 75% overlap
+	blocks = np.convolve(power, np.full(4, 0.25), mode="valid")
+	blocks = blocks[blocks > 10 ** ((-70 + 0.691) / 10)]
+	if len(blocks) == 0: return None
+	threshold = blocks.mean() * 0.1
+	blocks = blocks[blocks > threshold]
+	return float(-0.691 + 10 * np.log10(blocks.mean()))
@@ -0,0 +1,53 @@
+import atexit, os, threading, time
+
+def write_atomic(file, data, mode="w"):
+	""" Write data to a temporary file first and replace the file with it once it is written completely, so the file is never left partially written """
+	tmp_file = file + ".tmp"
+	with open(tmp_file, mode) as out: out.write(data)
+	os.replace(tmp_file, file)
+
+class PersistenceService:
+	"""
+	 Saves changed state to disk on a background thread
+	 Instead of writing to disk on every change, callers schedule the function that saves their state,
+	 all functions scheduled within 'interval' seconds are called once when this interval has passed (or when 'flush' is called)
+	 Scheduled functions are called from the background thread, they must not rely on being called from the thread that scheduled them
+	"""
+	interval = 5
+
+	def __init__(self):
+		self._pending = {}
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._thread = None
+		atexit.register(self.flush)
+
+	def schedule(self, save):
+		""" Schedule given function to be called within 'interval' seconds, it is only called once no matter how many times it was scheduled """
+		with self._lock:
+			self._pending[save] = None
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(name="PersistenceService", target=self._run, daemon=True)
+				self._thread.start()
+
+	def flush(self):
+		""" Call all scheduled functions now, blocks until they have finished """
+		with self._flush_lock:
+			with self._lock:
+				pending = list(self._pending.keys())
+				self._pending.clear()
+
+			for save in pending:
+				try: save()
+				except Exception as e: print("ERROR", "Saving data in the background:", e)
+
+	def _run(self):
+		while True:
+			time.sleep(self.interval)
+			self.flush()
+			with self._lock:
+				if not self._pending:
+					self._thread = None
+					return
+
+persistence_service = PersistenceService()
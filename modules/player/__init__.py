@@ -1,11 +1,12 @@
-import enum, os, random
-from datetime import datetime
+import enum, os, random, threading
+from datetime import date, datetime, timedelta
 
 from .mediaplayer import MediaPlayer
-from . import albumwindow, mediacontrols, lyricviewer, songbrowser, song_tracker, songhistory, songqueue
+from . import albumwindow, crossfade, mediacontrols, lyricviewer, songbrowser, songstats, song_tracker, songhistory, songqueue
+from .songcatalog import song_catalog
 
 from ui.qt import pyelement
-from core import messagetypes, modules
+from core import messagetypes, modules, persistence
 module = modules.Module(__package__)
 
 # MODULE SPECIFIC VARIABLES
@@ -13,6 +14,7 @@ media_player = MediaPlayer()
 media_controller = mediacontrols.controller
 song_queue = songqueue.song_queue
 song_history = songhistory.song_history
+play_statistics = songstats.play_statistics
 invalid_cfg = messagetypes.Reply("Invalid directory configuration, check your options")
 unknown_song = messagetypes.Reply("That song doesn't exist and there is nothing playing")
 no_songs = messagetypes.Reply("No songs found")
@@ -29,6 +31,7 @@ class Autoplay(enum.Enum):
 	OFF = 0
 	QUEUE = 1
 	ON = 2
+	SHUFFLE = 3
 autoplay = Autoplay.OFF
 autoplay_ignore = False
 player_autoplay_update_task = "player_autoplay_update"
@@ -40,16 +43,14 @@ def get_song(arg):
 		path = dir.get(arg[0])
 		if path is not None:
 			path = path["$path"]
-			return path, media_player.find_song(path, arg[1:])
+			songs = media_player.find_song(path, arg[1:])
+			return path, songs if songs else media_player.search_song(path, arg[1:], MAX_LIST)
 
 		paths = [(key, vl["$path"], vl["priority"]) for key, vl in dir.items() if vl["priority"] > 0]
 		paths.sort(key=lambda a: a[2])
-		songs = None
-		for pt in paths:
-			path = pt
-			songs = media_player.find_song(pt[1], arg)
-			if len(songs) > 0: break
-		return (path, songs) if songs else (None, None)
+		index, songs = media_player.find_song_first([pt[1] for pt in paths], arg)
+		if not songs: index, songs = media_player.search_song_first([pt[1] for pt in paths], arg, MAX_LIST)
+		return (paths[index], songs) if songs else (None, None)
 	else:
 		meta = media_player.current_media
 		if meta is not None:
@@ -81,9 +82,18 @@ def play_song(display, song, path):
 	else: return no_songs
 
 def put_queue(display, song, path):
-	song_queue.add((path[1] if isinstance(path, tuple) else path, song))
+	song_queue.add(song_catalog.get_file_id(path[1] if isinstance(path, tuple) else path, song))
 	return messagetypes.Reply("Song '{}' added to queue".format(display))
 
+def update_crossfade():
+	""" Apply the crossfade settings from the configuration to the player, returns an error message if they are invalid """
+	try:
+		media_player.update_crossfade(duration=float(module.configuration.get_or_create("crossfade_duration", 0)),
+									  start=float(module.configuration.get_or_create("crossfade_start", 0)) or None,
+									  curve=module.configuration.get_or_create("crossfade_curve", "linear"))
+	except (ValueError, TypeError) as e: return f"Invalid crossfade configuration: {e}"
+	return None
+
 def set_autoplay_ignore(ignore):
 	global autoplay_ignore
 	autoplay_ignore = bool(ignore)
@@ -110,6 +120,13 @@ def command_autoplay_on(arg, argc):
 		set_autoplay_ignore(False)
 		return messagetypes.Reply("Autoplay is turned on")
 
+def command_autoplay_shuffle(arg, argc):
+	if argc == 0:
+		global autoplay
+		autoplay = Autoplay.SHUFFLE
+		set_autoplay_ignore(False)
+		return messagetypes.Reply("Autoplay is turned on, all songs in the filter are played once before any song repeats")
+
 def command_autoplay_queue(arg, argc):
 	if argc == 0:
 		global autoplay
@@ -126,11 +143,24 @@ def command_autoplay_next(arg, argc):
 
 		global autoplay
 		if autoplay.value > 0 and len(song_queue) > 0:
-			song = song_queue.get_next()
-			media_player.play_song(path=song[0], song=song[1])
+			path, song = song_catalog.get_file(song_queue.get_next())
+			media_player.play_song(path=path, song=song)
+		elif autoplay == Autoplay.SHUFFLE: media_player.shuffle_song()
 		elif autoplay.value > 1: media_player.random_song()
 		return messagetypes.Empty()
 
+def command_autoplay_prepare(arg, argc):
+	if argc == 0:
+		if autoplay_ignore: return messagetypes.Empty()
+
+		queued = song_queue.peek_next() if autoplay.value > 0 else None
+		if queued is not None: song = song_catalog.get_file(queued)
+		elif autoplay == Autoplay.SHUFFLE: song = media_player.peek_shuffle_song()
+		elif autoplay.value > 1: song = media_player.peek_random_song()
+		else: song = None
+		if song is not None: media_player.prepare_song(*song)
+		return messagetypes.Empty()
+
 # - configure random song filter
 def command_filter_clear(arg, argc):
 	if argc == 0:
@@ -177,6 +207,59 @@ def command_info_played(arg, argc):
 	if path is not None and song is not None: return messagetypes.Select("Multiple songs found", get_playcount, song, alltime=alltime)
 	else: return unknown_song
 
+def parse_numbers(arg, defaults):
+	""" Parse the given arguments as integers, missing arguments get the value from defaults, returns None if an argument isn't a positive integer """
+	if len(arg) > len(defaults): return None
+	try: values = [int(a) for a in arg]
+	except ValueError: return None
+	return values + defaults[len(values):] if all(value > 0 for value in values) else None
+
+def command_info_top(arg, argc):
+	values = parse_numbers(arg, [30, MAX_LIST])
+	if values is None: return messagetypes.Reply("Usage: info top [days] [number of songs]")
+
+	days, n = values
+	today = date.today()
+	songs = play_statistics.get_top(today - timedelta(days=days - 1), today, n)
+	if not songs: return messagetypes.Reply(f"No songs played in the last {days} days")
+	return messagetypes.Reply(f"Most played songs in the last {days} days:\n" + "\n".join(f"  {i + 1}. {song} ({count}x)" for i, (song, count) in enumerate(songs)))
+
+def command_info_artist(arg, argc):
+	weeks = 12
+	if argc > 1:
+		try:
+			weeks = int(arg[-1])
+			arg.pop(-1)
+		except ValueError: pass
+	if len(arg) == 0 or weeks <= 0: return messagetypes.Reply("Usage: info artist <artist> [weeks]")
+
+	artist = " ".join(arg)
+	today = date.today()
+	start = today - timedelta(days=today.weekday() + 7 * (weeks - 1))
+	counts = play_statistics.get_artist_weeks(artist, start, weeks)
+	if not any(counts): return messagetypes.Reply(f"No songs from '{artist}' played in the last {weeks} weeks")
+	return messagetypes.Reply(f"Plays per week for '{artist}':\n" + "\n".join("  Week of {dt:%B} {dt.day}: {count}".format(dt=start + timedelta(weeks=i), count=count) for i, count in enumerate(counts)))
+
+def command_info_unplayed(arg, argc):
+	values = parse_numbers(arg, [6])
+	if values is None: return messagetypes.Reply("Usage: info unplayed [months]")
+
+	months = values[0]
+	songs = play_statistics.get_unplayed(date.today() - timedelta(days=30 * months))
+	if not songs: return messagetypes.Reply(f"Every song was played in the last {months} months")
+	res = f"{len(songs)} songs not played in the last {months} months:\n" + "\n".join("  {} (last played {dt:%B} {dt.day}, {dt.year})".format(song, dt=dt) for song, dt in songs[:MAX_LIST])
+	if len(songs) > MAX_LIST: res += f"\n  ... and {len(songs) - MAX_LIST} more"
+	return messagetypes.Reply(res)
+
+def command_info_events(arg, argc):
+	if argc == 0:
+		counts = media_player.position_events
+		timings = sorted(media_player.handler_timings.items(), key=lambda item: item[1][1], reverse=True)
+		reply = (f"Position changes: {counts['received']} received, {counts['published']} published, "
+				 f"{counts['rate_limited']} coalesced by the rate limit, {counts['unchanged']} without visible change")
+		if timings: reply += "\nEvent handlers (calls, total, longest):\n  - " + "\n  - ".join(f"{key}: {calls}x, {total * 1000:.0f}ms, {longest * 1000:.1f}ms" for key, (calls, total, longest) in timings[:MAX_LIST])
+		return messagetypes.Reply(reply)
+
 def command_info_player(arg, argc):
 	window = module.client.find_window("player_info")
 	if window is None: module.client.add_window(window_class=songhistory.PlayerInfoWindow)
@@ -185,7 +268,9 @@ def command_info_player(arg, argc):
 def command_info_reload(arg, argc):
 	if argc == 0:
 		song_tracker.load_tracker()
-		return messagetypes.Reply("Song tracker reloaded")
+		play_statistics.reload()
+		media_player.library.refresh()
+		return messagetypes.Reply("Song tracker and library reloaded")
 
 def command_lyrics(arg, argc):
 	path, song = get_song(arg)
@@ -207,6 +292,22 @@ def command_volume(arg, argc):
 		return messagetypes.Reply("Player volume updated")
 
 # - player specific commands
+def command_crossfade(arg, argc):
+	if argc == 0:
+		duration, start, curve = media_player.crossfade
+		if duration > 0: return messagetypes.Reply(f"Crossfading songs in {duration}s using the '{curve}' curve, starting {start}s before the end")
+		else: return messagetypes.Reply("Crossfade is off")
+	elif argc <= 2:
+		try: duration = float(arg[0])
+		except ValueError: return messagetypes.Reply("Invalid value")
+		if argc > 1 and arg[1] not in crossfade.curves: return messagetypes.Reply(f"Unknown curve, options are: {', '.join(crossfade.curves)}")
+
+		module.configuration["crossfade_duration"] = duration
+		if argc > 1: module.configuration["crossfade_curve"] = arg[1]
+		error = update_crossfade()
+		if error: return messagetypes.Reply(error)
+		return messagetypes.Reply(f"Crossfade set to {duration}s" if duration > 0 else "Crossfade turned off")
+
 def command_pause(arg, argc):
 	media_player.pause_player(arg[0] if argc > 0 else None)
 	return messagetypes.Empty()
@@ -236,7 +337,8 @@ def command_prev_song(arg, argc):
 	if argc == 0:
 		item = song_history.get_previous(song_history.head)
 		if item is not None:
-			media_player.play_song(path=item[0], song=item[1])
+			path, song = song_catalog.get_file(item)
+			media_player.play_song(path=path, song=song)
 			set_autoplay_ignore(False)
 		return messagetypes.Empty()
 
@@ -253,8 +355,8 @@ def command_queue_clear(arg, argc):
 def command_queue_next(arg, argc):
 	if argc == 0:
 		if len(song_queue) > 0:
-			item = song_queue.get_next()
-			media_player.play_song(path=item[0], song=item[1])
+			path, song = song_catalog.get_file(song_queue.get_next())
+			media_player.play_song(path=path, song=song)
 			set_autoplay_ignore(False)
 			return messagetypes.Empty()
 		else: return messagetypes.Reply("Queue is empty")
@@ -328,11 +430,14 @@ module.commands = {
 		"": albumwindow.command_album,
 		"add": albumwindow.command_album_add,
 		"delete": albumwindow.command_album_remove,
-		"list": albumwindow.command_album_list
+		"list": albumwindow.command_album_list,
+		"queue": albumwindow.command_album_queue
 	}, "autoplay": {
 		"next": command_autoplay_next,
 		"off": command_autoplay_off,
+		"prepare": command_autoplay_prepare,
 		"on": command_autoplay_on,
+		"shuffle": command_autoplay_shuffle,
 		"skip": command_autoplay_ignore,
 		"queue": command_autoplay_queue
 	}, "filter": {
@@ -340,12 +445,17 @@ module.commands = {
 		"none": command_filter_clear
 	}, "info": {
 		"added": command_info_added,
+		"artist": command_info_artist,
+		"events": command_info_events,
 		"played": command_info_played,
 		"player": command_info_player,
-		"reload": command_info_reload
+		"reload": command_info_reload,
+		"top": command_info_top,
+		"unplayed": command_info_unplayed
 	}, "lyrics": command_lyrics,
 	"player": {
 		"": command_play,
+		"crossfade": command_crossfade,
 		"last_random": command_last_random,
 		"mute": command_mute,
 		"next": command_next_song,
@@ -376,10 +486,15 @@ module.commands = {
 @module.Initialize
 def initialize():
 	media_player.update_blacklist(module.configuration.get_or_create("artist_blacklist", []))
+	error = update_crossfade()
+	if error: print("WARNING", error)
+	try: media_player.position_rate = max(float(module.configuration.get_or_create("position_update_rate", MediaPlayer.position_rate)), 0.1)
+	except (ValueError, TypeError): print("WARNING", "Invalid value for 'position_update_rate', it must be a number of updates per second")
 	media_player.attach_event("media_changed", on_media_change)
 	media_player.attach_event("pos_changed", on_pos_change)
 	media_player.attach_event("player_updated", on_player_update)
 	media_player.attach_event("end_reached", on_end_reached)
+	media_player.attach_event("crossfade", on_crossfade)
 	media_player.attach_event("stopped", on_stopped)
 	media_player.attach_event("volume_changed", on_volume_changed)
 	media_player.attach_event("muted", on_player_mute_toggle)
@@ -427,6 +542,8 @@ def initialize():
 	directory = module.configuration.get_or_create_configuration("directory", {})
 	directory.default_value = {"#color": "", "$path": "", "priority": -1}
 	module.configuration.get_or_create(default_dir_path, "")
+	media_player.library.start_watcher()
+	threading.Thread(name="LibraryLoader", target=_load_library, args=([vl["$path"] for vl in module.configuration["directory"].values()],), daemon=True).start()
 
 	# only add window media binds when the media controller isn't available, otherwise media key events will happen twice
 	if not media_controller.can_bind:
@@ -460,20 +577,29 @@ def initialize():
 	songbrowser.initialize()
 	command_filter_clear(None, 0)
 
+def _load_library(paths):
+	media_player.library.load(paths)
+	media_player.analyze_library()
+
 @module.Destroy
 def on_destroy():
 	media_player.on_destroy()
+	persistence.persistence_service.flush()
 
 def on_media_change(event, player):
+	# handlers run on the player event thread, the media is taken from the event since the player may already be playing something else
+	media = event.data
+	if media is None: return
+
 	color = None
 	for key, options in module.configuration["directory"].items():
-		if media_player.current_media.path == options["$path"]:
+		if media.path == options["$path"]:
 			color = options.get("#color")
 			break
-	module.client.schedule_task(task_id="player_title_update", media=media_player.current_media, color=color)
+	module.client.schedule_task(task_id="player_title_update", media=media, color=color)
 
 def on_pos_change(event, player):
-	module.client.schedule_task(task_id="player_progress_update", progress=player.get_position())
+	module.client.schedule_task(task_id="player_progress_update", progress=event.position)
 
 def on_stopped(event, player):
 	module.client.schedule_task(task_id="player_progress_update", progress=0)
@@ -484,13 +610,19 @@ def on_player_update(event, player):
 
 	if default_directory is not None and md.path == default_directory["$path"]:
 		song_tracker.add(md.display_name)
-		try: module.client["player"]["songbrowser"].add_count(md.display_name)
-		except KeyError: pass
-	song_history.add([md.path, md.song])
+		songbrowser.add_count(md.display_name)
+	song_history.add(song_catalog.get_file_id(md.path, md.song))
+	# the song is now close to its end, prepare the song autoplay will pick next (vlc functions can't be called from its events)
+	module.interpreter.put_command("autoplay prepare")
 
 def on_end_reached(event, player):
 	module.interpreter.put_command("autoplay next")
 
+def on_crossfade(event, player):
+	# only start the next song early when autoplay will play one, otherwise the current song has to end first
+	if not autoplay_ignore and (autoplay.value > 1 or (autoplay.value > 0 and len(song_queue) > 0)):
+		module.interpreter.put_command("autoplay next")
+
 def on_volume_changed(event, player):
 	module.client.schedule_task(task_id=player_volume_update_task, volume=player.volume)
 
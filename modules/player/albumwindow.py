@@ -3,6 +3,8 @@ import json, os
 from ui.qt import pyimage, pywindow, pyelement
 from core import messagetypes, modules
 module = modules.Module(__package__)
+from .songcatalog import song_catalog
+from .songqueue import song_queue
 
 media_player = None
 album_folder = "albums"
@@ -49,7 +51,7 @@ class AlbumWindow(pywindow.PyWindow):
 
 		bt = pyelement.PyButton(self, "action_queue")
 		@bt.events.EventInteract
-		def _queue_all(): self._cb("queue", self["songlist"].itemlist)
+		def _queue_all(): module.interpreter.put_command(f"album queue {self._metadata['command_name']}")
 		bt.text = "Queue all"
 		self.add_element(element=bt, row=3)
 
@@ -272,9 +274,13 @@ def initialize(player):
 
 def get_songmatches(path, keyword):
 	if not path: return None
-	ls = media_player.find_song(path=module.configuration["directory"].get(path)["$path"], keyword=keyword.split(" "))
+	path = module.configuration["directory"].get(path)["$path"]
+	ls = media_player.find_song(path=path, keyword=keyword.split(" "))
 	if len(ls) == 1: return ls[0]
-	else: return None
+	elif len(ls) == 0:
+		ls = media_player.search_song(path=path, keyword=keyword.split(" "), limit=1)
+		if ls: return ls[0]
+	return None
 
 def load_album_data(album_file):
 	with open(album_format.format(album_file, "json"), "r") as file:
@@ -289,12 +295,29 @@ def album_list(keyword=""):
 def album_process(type, songs):
 	for s in songs: module.interpreter.put_command("{} {} {}.".format(type, "music", s.replace(" - ", " ")))
 
+def queue_album(album_data):
+	""" Add all songs from an album to the queue at once, the songs are looked up together in the album directory """
+	try: path = module.configuration["directory"][album_data["song_path"]]["$path"]
+	except KeyError: return messagetypes.Reply(f"Unknown directory '{album_data['song_path']}' for album '{album_data['name']}'")
+
+	names = album_data["songlist"]
+	songs = media_player.find_songs(path, names)
+	song_queue.extend([song_catalog.get_file_id(path, song) for song, exact in songs if song is not None])
+	missing = [name for name, (song, exact) in zip(names, songs) if song is None]
+	# songs without an exact match may be a different song entirely, so every replacement is shown
+	replaced = [f"{name} -> {song}" for name, (song, exact) in zip(names, songs) if song is not None and not exact]
+	reply = f"Added {len(names) - len(missing)} songs from '{album_data['name']}' to queue"
+	if replaced: reply += "\nSongs without an exact match were replaced by the closest match:\n  - " + "\n  - ".join(replaced)
+	if missing: reply += "\nSongs not found:\n  - " + "\n  - ".join(missing)
+	return messagetypes.Reply(reply)
+
 # === Album commands ===
 def command_album(arg, argc):
 	if argc > 0:
 		try: meta = load_album_data("_".join(arg))
 		except FileNotFoundError: return messagetypes.Reply("Unknown album")
 
+		meta["command_name"] = "_".join(arg)
 		module.client.add_window(window_class=AlbumWindow, command_callback=album_process, album_data=meta)
 		return messagetypes.Reply("Album opened")
 	else:
@@ -310,6 +333,12 @@ def command_album_add(arg, argc, display=None, album=None):
 	module.client.add_window(window_class=AlbumWindowInput, album_file=album, autocomplete_callback=get_songmatches)
 	return messagetypes.Reply(f"Album editor for '{display}' opened" if display else "Album creator opened")
 
+def command_album_queue(arg, argc):
+	if argc > 0:
+		try: meta = load_album_data("_".join(arg))
+		except FileNotFoundError: return messagetypes.Reply("Unknown album")
+		return queue_album(meta)
+
 def command_album_remove(arg, argc):
 	if argc > 0:
 		import os
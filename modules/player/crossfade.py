@@ -0,0 +1,78 @@
+import math, threading, time
+
+# Every curve returns the volume level (between 0 and 1) of the song fading out and the song fading in for the progress of the crossfade (between 0 and 1)
+curves = {
+	"linear": lambda t: (1 - t, t),
+	"equal_power": lambda t: (math.cos(t * math.pi / 2), math.sin(t * math.pi / 2)),
+	"s_curve": lambda t: (1 - t * t * (3 - 2 * t), t * t * (3 - 2 * t))
+}
+
+class Crossfade:
+	"""
+	 Ramps the volume of the song that ends down while the volume of the next song goes up, on its own timer thread
+	 Every 'interval' seconds the levels from the curve are passed to the 'set_levels' function of the crossfade,
+	 once the crossfade is done 'on_complete' is called so the song that faded out can be stopped
+	 Only one crossfade runs at a time, starting a new one replaces the one that is running without completing it
+	"""
+	interval = 0.05
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		self._fade = None
+		self._thread = None
+
+	@property
+	def active(self):
+		""" True if a crossfade is running """
+		return self._fade is not None
+
+	def start(self, duration, set_levels, curve="linear", on_complete=None):
+		"""
+		 Start a crossfade lasting 'duration' seconds using the named curve
+		 'set_levels' must accept the level of the song fading out and the level of the song fading in, 'on_complete' (if given) is called without arguments
+		"""
+		curve_function = curves.get(curve)
+		if curve_function is None: raise ValueError(f"Unknown crossfade curve '{curve}'")
+
+		with self._condition:
+			self._fade = (time.monotonic(), duration, curve_function, set_levels, on_complete)
+			if self._thread is None:
+				self._thread = threading.Thread(name="Crossfade", target=self._run, daemon=True)
+				self._thread.start()
+			else: self._condition.notify()
+
+	def cancel(self):
+		""" Stop the running crossfade where it is, without completing it """
+		with self._condition:
+			self._fade = None
+			self._condition.notify()
+
+	def finish(self):
+		""" Complete the running crossfade immediately, has no effect if there is none """
+		with self._condition:
+			fade, self._fade = self._fade, None
+			if fade is not None: self._complete(fade)
+			self._condition.notify()
+
+	@staticmethod
+	def _complete(fade):
+		start, duration, curve, set_levels, on_complete = fade
+		set_levels(*curve(1))
+		if on_complete is not None: on_complete()
+
+	def _run(self):
+		# levels are only updated while holding the lock, so a crossfade that was cancelled or finished never gets updated afterwards
+		with self._condition:
+			while self._fade is not None:
+				fade = self._fade
+				start, duration, curve, set_levels, on_complete = fade
+				progress = (time.monotonic() - start) / duration if duration > 0 else 1
+				try:
+					if progress >= 1:
+						self._fade = None
+						self._complete(fade)
+					else: set_levels(*curve(progress))
+				except Exception as e: print("ERROR", "Updating crossfade:", e)
+
+				if self._fade is not None: self._condition.wait(self.interval)
+			self._thread = None
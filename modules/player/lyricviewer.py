@@ -3,6 +3,7 @@ from bs4 import BeautifulSoup, element
 
 from ui.qt import pywindow, pyelement, pyworker
 from core import messagetypes, modules
+from .songmetadata import split_displayname
 module = modules.Module(__package__)
 
 main_window_id = "lyricviewer"
@@ -117,8 +118,12 @@ class TaskLyrics(pyworker.PyWorker):
 		else: print("INFO", "Lyrics collected but no lyrics window found")
 
 unknown_song = messagetypes.Reply("Unknown song")
-def get_lyrics(song, file=None):
-	artist, title = song.split(" - ", maxsplit=1)
+def get_lyrics(song, file=None, path=None):
+	if isinstance(path, tuple): path = path[1]
+	metadata = module.media_player.get_metadata(path, file) if path and file else None
+	if metadata is not None and metadata.artist and metadata.title: artist, title = metadata.artist, metadata.title
+	else: artist, title = split_displayname(song)
+
 	if artist and title:
 		if (window := module.client.find_window(main_window_id)) is None:
 			module.client.add_window(main_window_id, window_class=LyricViewer, artist=artist, title=title)
@@ -127,5 +132,5 @@ def get_lyrics(song, file=None):
 	else: return unknown_song
 
 def command_lyrics(path, song):
-	if path is not None and song is not None: return messagetypes.Select("Multiple songs found", get_lyrics, song)
+	if path is not None and song is not None: return messagetypes.Select("Multiple songs found", get_lyrics, song, path=path)
 	else: return unknown_song
\ No newline at end of file
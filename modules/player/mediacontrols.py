@@ -57,9 +57,8 @@ try:
             elif btn == SystemMediaTransportControlsButton.PREVIOUS: self._call_button("previous")
 
         def _on_update(self, event, player):
-            song = player.current_media.display_name.split(" - ", maxsplit=1)
-            if len(song) > 1: self._update_data(artist=song[0], title=song[1])
-            else: self._update_data(title=song[0])
+            media = event.data
+            if media is not None: self._update_data(artist=media.artist or "", title=media.title)
 
         def _on_play(self, event, player):
             self._win_controls.is_pause_enabled = self._win_controls.is_play_enabled = True
@@ -1,6 +1,11 @@
-import os, random
+import itertools, os, queue, random, threading, time
 import vlc as VLCPlayer
 
+from .crossfade import Crossfade, curves as crossfade_curves
+from .shufflebag import ShuffleBag
+from .songlibrary import SongLibrary, path_key
+from .songmetadata import MetadataStore, split_displayname
+
 
 def get_displayname(filepath):
 	return os.path.splitext(filepath)[0]
@@ -11,10 +16,24 @@ class DynamicClass:
 	def __str__(self): return "{}({})".format(self.__class__.__name__, ", ".join(["{}='{}'".format(*it) for it in self.__dict__.items()]))
 
 class MediaPlayerData(DynamicClass):
-	def __init__(self, path, song, **kwargs):
+	def __init__(self, path, song, metadata=None, **kwargs):
 		self.path = path
 		self.song = song
 		self.display_name = get_displayname(song)
+		self.artist, self.title = split_displayname(self.display_name)
+		self.album = self.duration = None
+		if metadata is not None:
+			if metadata.artist: self.artist = metadata.artist
+			if metadata.title: self.title = metadata.title
+			self.album, self.duration = metadata.album, metadata.duration
+		DynamicClass.__init__(self, **kwargs)
+
+class MediaPlayerEvent(DynamicClass):
+	""" Copy of the type of a vlc event together with the media that was playing when it happened,
+	 	the event from vlc itself is only valid while its callback runs and the player may have moved on by the time the handlers are called """
+	def __init__(self, type, data=None, **kwargs):
+		self.type = type
+		self.data = data
 		DynamicClass.__init__(self, **kwargs)
 
 class MediaPlayerEventUpdate(DynamicClass):
@@ -26,8 +45,19 @@ class MediaPlayerEventUpdate(DynamicClass):
 class MediaPlayer:
 	""" Helper class for playing music using the vlc python bindings
 	 	When a new song is started when the last song is almost done,
-	 	the player will start the new song without stopping the previous for smooth transitioning  """
+	 	the player will start the new song without stopping the previous for smooth transitioning
+	 	When the loudness of a song is known, its volume is adjusted so all songs play at the same loudness
+	 	The song that is expected to play next can be prepared ahead of time, its media is then parsed and set on the idle player before it is needed
+	 	When crossfading is enabled, the next song is started a number of seconds before the current song ends and the volume of both songs is ramped on a timer thread
+	 	Position changes are passed to the 'pos_changed' handlers at most 'position_rate' times per second and only when the position moved by at least 'position_step',
+	 	the last position is always passed on when the player pauses so the handlers don't keep a position that was skipped by the rate limit
+	 	Attached event handlers are called one by one on a separate event thread, not on the thread vlc calls its events on,
+	 	every handler is timed and a warning is shown for handlers that take longer than 'slow_handler_time' seconds """
 	end_pos = 0.85
+	max_gain = 6
+	position_rate = 4
+	position_step = 0.0001
+	slow_handler_time = 0.05
 
 	def __init__(self):
 		print("VERBOSE", "Initializing new MediaPlayer instance...")
@@ -40,9 +70,26 @@ class MediaPlayer:
 		self._paused = False
 		self._player_one = True
 		self._media = self._media_data = None
+		self._prepared = self._next_random = None
 		self._updated = False
 		self._filter = self._blacklist = self._last_random = None
 		self._last_position = 0
+		self._published_position = (0, -1)
+		self._position_events = {"received": 0, "published": 0, "rate_limited": 0, "unchanged": 0}
+		self._volume = None
+		self._gains = [1.0, 1.0]
+		self._fades = [1.0, 1.0]
+		self._plays = [0, 0]
+		self._media_gain = 0
+		self._crossfade = (0, 0, "linear")
+		self._crossfade_started = False
+		self._crossfader = Crossfade()
+		self._library = SongLibrary(os.path.join(".cache", "library"))
+		self._library.add_listener(self._on_library_update)
+		self._metadata = MetadataStore(os.path.join(".cache", "metadata.db"))
+		self._metadata.add_listener(self._on_metadata_update)
+		self._random_pool = None
+		self._shuffle_bag = ShuffleBag(os.path.join(".cache", "shufflebag"))
 
 		self._events = {
 			"end_reached": (VLCPlayer.EventType.MediaPlayerEndReached, self.on_song_end, []),
@@ -64,6 +111,12 @@ class MediaPlayer:
 
 		# register custom event handlers
 		self._events["player_updated"] = (MediaPlayerEventUpdate, self.on_update, [])
+		self._events["crossfade"] = (MediaPlayerEventUpdate, self.on_update, [])
+
+		self._event_queue = queue.SimpleQueue()
+		self._handler_timings = {}
+		self._event_thread = threading.Thread(name="MediaPlayerEvents", target=self._dispatch_events, daemon=True)
+		self._event_thread.start()
 
 	# === PLAYER PROPERTIES ===
 	@property
@@ -84,6 +137,38 @@ class MediaPlayer:
 		""" Returns information about the current song playing, or None if nothing playing """
 		return self._media_data
 
+	@property
+	def last_position(self):
+		""" The last known position of the current song, between 0 and 1 """
+		return self._last_position
+
+	@property
+	def position_events(self):
+		""" Counters for the position changes received from vlc: how many were published to the handlers and how many were coalesced because of the rate limit or because the position didn't change enough """
+		return dict(self._position_events)
+
+	@property
+	def library(self):
+		""" The index of all songs known to this player """
+		return self._library
+
+	@property
+	def metadata(self):
+		""" The cache containing the tags of all songs in the library """
+		return self._metadata
+
+	def get_metadata(self, path, song):
+		""" Returns the metadata read from the tags of the song in given path, or None if it isn't known (yet) """
+		return self._get_index_metadata(self._library.get_index(path), path, song)
+
+	def _get_index_metadata(self, index, path, song):
+		entry = index.get(song) if index is not None else None
+		return self._metadata.get(os.path.join(path, song), entry.mtime, entry.size) if entry is not None else None
+
+	def analyze_library(self):
+		""" Make sure the metadata for all songs in the library is read """
+		for index in self._library.indexes: self._metadata.analyze(index.path, index.entries)
+
 	@property
 	def filter_path(self): return self._filter[0] if self._filter is not None else ""
 	@property
@@ -92,6 +177,19 @@ class MediaPlayer:
 		""" Set a filter for random song picking using path and keyword
 		 	(will override the blacklist that was set on this player) """
 		self._filter = [path, keyword]
+		self._random_pool = None
+
+	@property
+	def crossfade(self):
+		""" Tuple (duration, start, curve) with the current crossfade settings """
+		return self._crossfade
+	def update_crossfade(self, duration=0, start=None, curve="linear"):
+		""" Crossfade from the current song to the next song during 'duration' seconds, a duration of 0 disables crossfading
+		 	'start' is the number of seconds before the end of the song the 'crossfade' event is fired to start the next song, it defaults to the duration
+		 	'curve' is the name of the curve used for the volume of both songs, see 'crossfade.curves' """
+		if curve not in crossfade_curves: raise ValueError(f"Unknown crossfade curve '{curve}'")
+		duration = max(0, duration)
+		self._crossfade = (duration, max(0, start) if start is not None else duration, curve)
 
 	@property
 	def blacklist(self): return self._blacklist
@@ -100,6 +198,7 @@ class MediaPlayer:
 		 	This list is ignored when a filter is set or when choosing a specific song """
 		if blacklist is not None and not isinstance(blacklist, list): raise TypeError("Blacklist must be a list!")
 		self._blacklist = blacklist
+		self._random_pool = None
 
 	# === PLAYER UTILITIES ===
 	def list_songs(self, path, keyword="", exact_search=False):
@@ -109,35 +208,16 @@ class MediaPlayer:
 				keyword: [optional], returns all items matching this keyword or all items if no argument passed
 				exact_search: [optional], set true to only look for songs with an exact match """
 		print("VERBOSE", f"looking for songs in '{path}' with keyword(s) '{keyword}'")
-		res1 = []
-		res2 = []
-		keyword = keyword.lower()
-
-		if os.path.isdir(path):
-			with os.scandir(path) as dir:
-				for entry in dir:
-					if entry.is_file():
-						file = entry.name
-						song = get_displayname(file.replace(" - ", " ").lower())
-						if exact_search and song == keyword: return [file]
-						elif " " + keyword + " " in " " + song + " ": res1.append(file)
-						elif keyword == "" or keyword in song: res2.append(file)
-
-		if len(res1) > 0:
-			print("VERBOSE", f"Found {len(res1)} exact match(es)")
-			return res1
-		else:
-			print("VERBOSE", f"Found {len(res2)} match(es) containing required keyword(s)")
-			return res2
+		res = self._library.list_songs(path, keyword, exact_search)
+		print("VERBOSE", f"Found {len(res)} match(es) for required keyword(s)")
+		return res
 
-	def find_song(self, path, keyword=None):
-		""" Find songs in given path that contain given keyword, where keyword should be a string list separated by spaces
-			- when the keyword ends with a '.' only an exact match (if it exists) is returned
-			- when the keyword ends with a number, this number will be used for picking one from the found selection (if in range)
-			-> Returns a list of songs found where each item is a tuple: (displayname, song) """
+	@staticmethod
+	def _parse_keyword(keyword):
 		exact = False
 		index = -1
-		if keyword and len(keyword) > 0:
+		keyword = list(keyword) if keyword else []
+		if len(keyword) > 0:
 			if keyword[-1].endswith("."):
 				exact = True
 				keyword[-1] = keyword[-1][:-1]
@@ -146,12 +226,56 @@ class MediaPlayer:
 					index = int(keyword[-1])
 					keyword.pop(-1)
 				except ValueError: pass
+		return " ".join(keyword), exact, index
 
-		keyword = " ".join(keyword)
-		ls = self.list_songs(path, keyword, exact_search=exact)
+	@staticmethod
+	def _select_songs(ls, index):
 		if 0 <= index < len(ls): return [(get_displayname(ls[index]), ls[index])]
 		else: return [(get_displayname(s), s) for s in ls]
 
+	def find_song(self, path, keyword=None):
+		""" Find songs in given path that contain given keyword, where keyword should be a string list separated by spaces
+			- when the keyword ends with a '.' only an exact match (if it exists) is returned
+			- when the keyword ends with a number, this number will be used for picking one from the found selection (if in range)
+			-> Returns a list of songs found where each item is a tuple: (displayname, song) """
+		keyword, exact, index = self._parse_keyword(keyword)
+		return self._select_songs(self.list_songs(path, keyword, exact_search=exact), index)
+
+	def find_song_first(self, paths, keyword=None):
+		""" Same as 'find_song' but looks in all given paths at the same time, the paths should be sorted on priority
+			-> Returns a tuple (index, songs) with the index of the first path that contains any matches, or (-1, []) if there are no matches in any path """
+		keyword, exact, index = self._parse_keyword(keyword)
+		print("VERBOSE", f"looking for songs in {len(paths)} directories with keyword(s) '{keyword}'")
+		path_index, ls = self._library.find_first(paths, lambda dir: dir.list_songs(keyword, exact))
+		return (path_index, self._select_songs(ls, index)) if ls else (-1, [])
+
+	def find_songs(self, path, names):
+		""" Find the songs for a list of display names in given path at once, names without an exact match use the best match of 'search_song'
+			-> Returns a list with for every name a tuple (filename of the song found or None if nothing was found, True if the song is an exact match) """
+		print("VERBOSE", f"Looking for {len(names)} songs in '{path}'")
+		songs = [(song, song is not None) for song in self._library.find_songs(path, names)]
+		for i, name in enumerate(names):
+			if songs[i][0] is None:
+				match = self.search_song(path, name.replace(" - ", " ").split(" "), limit=1)
+				if match: songs[i] = (match[0][1], False)
+		return songs
+
+	def search_song(self, path, keyword, limit=15):
+		""" Typo tolerant alternative for 'find_song' that can be used when it didn't find anything, where keyword should be a string list separated by spaces
+			- a '.' at the end of the keyword is ignored
+			-> Returns a list of at most 'limit' songs ordered from best to worst match where each item is a tuple: (displayname, song) """
+		keyword = " ".join(keyword).rstrip(".") if keyword else ""
+		print("VERBOSE", f"Searching for songs in '{path}' similar to '{keyword}'")
+		return [(get_displayname(song), song) for song, score in self._library.search(path, keyword, limit)]
+
+	def search_song_first(self, paths, keyword, limit=15):
+		""" Same as 'search_song' but looks in all given paths at the same time, the paths should be sorted on priority
+			-> Returns a tuple (index, songs) with the index of the first path that contains any matches, or (-1, []) if there are no matches in any path """
+		keyword = " ".join(keyword).rstrip(".") if keyword else ""
+		print("VERBOSE", f"Searching for songs in {len(paths)} directories similar to '{keyword}'")
+		path_index, ls = self._library.find_first(paths, lambda dir: dir.search(keyword, limit, self._library.min_search_score))
+		return (path_index, [(get_displayname(song), song) for song, score in ls]) if ls else (-1, [])
+
 	def play_song(self, path, song):
 		""" Plays a song only when the full path and song name are known and they exist in the given path
 			Returns the updated media data generated by the player if the file exists, or None otherwise """
@@ -170,32 +294,89 @@ class MediaPlayer:
 		if self._paused: self.stop_player()
 
 		if song:
-			self._media_data = MediaPlayerData(path, song)
+			self._media_data = MediaPlayerData(path, song, metadata=self.get_metadata(path, song))
 			url = os.path.join(path, song)
 		elif url: self._media_data = MediaPlayerData('', display_meta)
 
-		if self._media is not None: self._media.release()
-		self._media = self._vlc.media_new(url)
 		player = self.next_player
-		player.set_media(self._media)
+		i = 0 if self._player_one else 1
+		other = self._player2 if self._player_one else self._player1
+		fade = self._crossfade[0] > 0 and other.is_playing()
+		prepared, self._prepared = self._prepared, None
+		if prepared is not None and prepared[0] == url: media = prepared[1]
+		else:
+			if prepared is not None: prepared[1].release()
+			media = self._vlc.media_new(url)
+		# the length is only known when the media was prepared, a song that is shorter than the crossfade is not faded in
+		if fade and 0 < media.get_duration() < self._crossfade[0] * 1000: fade = False
+
+		if self._media is not None: self._media.release()
+		self._media = media
+		if prepared is None or prepared[1] is not media or prepared[2] is not player: player.set_media(media)
+		self._plays[i] += 1
+		self._fades[i] = 0.0 if fade else 1.0
 		player.play()
+		self._media_gain = self._metadata.get_gain(url) if song else 0
+		self._set_gain(self._player_one, self._media_gain)
+		self._crossfade_started = False
+		if fade:
+			print("VERBOSE", f"Crossfading to the next song in {self._crossfade[0]}s")
+			plays = self._plays[1 - i]
+			self._crossfader.start(self._crossfade[0], lambda out_level, in_level: self._set_fade(1 - i, out_level, i, in_level),
+									curve=self._crossfade[2], on_complete=lambda: self._end_crossfade(1 - i, plays))
+		else: self._crossfader.cancel()
 
 		self._paused = False
 		self._updated = True
+		self._published_position = (0, -1)
 		return self._media_data
 
 
+	def prepare_song(self, path, song):
+		""" Create and parse the media for a song that is likely to be played next, so it can start without delay when it is played using 'play_song'
+		 	When a player is idle the media is also set on it already, has no effect if the song doesn't exist or was already prepared """
+		url = os.path.join(path, song)
+		if self._prepared is not None:
+			if self._prepared[0] == url: return
+			self._prepared[1].release()
+			self._prepared = None
+		if not os.path.isfile(url): return
+
+		print("VERBOSE", f"Preparing '{song}' from '{path}' to play next")
+		media = self._vlc.media_new(url)
+		media.parse_with_options(VLCPlayer.MediaParseFlag.local, 0)
+		# the next player is only idle after the current song moved to the other player
+		player = self.next_player if not self._updated and not self.next_player.is_playing() else None
+		if player is not None: player.set_media(media)
+		self._prepared = (url, media, player)
+
+	def _set_fade(self, out_i, out_level, in_i, in_level):
+		self._fades[out_i], self._fades[in_i] = out_level, in_level
+		(self._player1 if out_i == 0 else self._player2).audio_set_volume(self._get_player_volume(out_i))
+		(self._player1 if in_i == 0 else self._player2).audio_set_volume(self._get_player_volume(in_i))
+
+	def _end_crossfade(self, i, plays):
+		# only stop the song that faded out, not a song that was started on the same player in the meantime
+		if self._plays[i] == plays: (self._player1 if i == 0 else self._player2).stop()
+		self._fades[i] = 1.0
+
+	def _stop_crossfade(self):
+		self._crossfader.cancel()
+		self._fades = [1.0, 1.0]
+
 	def reset(self):
 		""" Stops the player and attempts to restart the last played song from the last known position
 		 	In case of a transition this plays the song that was set last and aborts playing any other songs active
 		 	It does not however reset the update flag and won't trigger the 'player_updated' again (if it was already called) """
 		if self._media:
+			self._stop_crossfade()
 			self._player1.stop()
 			self._player2.stop()
 			self._player_one = True
 			self._player1.set_media(self._media)
 			self._player1.play()
 			self._player1.set_position(self._last_position)
+			self._set_gain(True, self._media_gain)
 
 
 	def get_position(self): return self.active_player.get_position()
@@ -207,6 +388,7 @@ class MediaPlayer:
 			print("VERBOSE", "Trying to update player position to {}".format(pos))
 			pl = self.active_player
 			if pl is not None:
+				self._published_position = (0, -1)
 				pl.set_position(pos)
 				pl.play()
 				return True
@@ -223,23 +405,39 @@ class MediaPlayer:
 			else: raise ValueError("Unsupported type")
 		else: self._paused = not self._paused and self._media_data is not None
 
+		if self._paused: self._crossfader.finish()
 		self._player1.set_pause(self._paused)
 		self._player2.set_pause(self._paused)
+		if self._paused: self._publish_last_position()
 
 	def stop_player(self):
 		""" Stop playback """
 		self._paused = False
+		self._stop_crossfade()
 		self._player1.stop()
 		self._player2.stop()
 		self._media_data = None
 
 	@property
-	def volume(self): return self._player1.audio_get_volume()
+	def volume(self): return self._volume if self._volume is not None else self._player1.audio_get_volume()
 	@volume.setter
 	def volume(self, volume):
-		volume = min(max(volume, 0), 100)
-		self._player1.audio_set_volume(volume)
-		self._player2.audio_set_volume(volume)
+		self._volume = min(max(volume, 0), 100)
+		self._player1.audio_set_volume(self._get_player_volume(0))
+		self._player2.audio_set_volume(self._get_player_volume(1))
+
+	def _set_gain(self, player_one, gain):
+		""" Update the volume of a player to apply given gain (in dB) on top of the volume set by the user """
+		i = 0 if player_one else 1
+		# the audio output of vlc (mmdevice) cubes the volume to get the amplitude, so the amplitude factor 10^(gain/20) is the volume factor 10^(gain/60)
+		self._gains[i] = 10 ** (min(max(gain, -20), self.max_gain) / 60)
+		if self._volume is None:
+			volume = self._player1.audio_get_volume()
+			self._volume = volume if volume >= 0 else 100
+		(self._player1 if player_one else self._player2).audio_set_volume(self._get_player_volume(i))
+
+	def _get_player_volume(self, i):
+		return min(round(self._volume * self._gains[i] * self._fades[i]), 200)
 
 	@property
 	def mute(self): return self._player1.audio_get_mute()
@@ -255,31 +453,78 @@ class MediaPlayer:
 		if keyword == "": keyword = self.filter_keyword
 
 		print("VERBOSE", f"Play random song from '{path}', keyword={keyword}")
-		songlist = []
-		for word in keyword.split("|"): songlist.extend(self.list_songs(path, word.strip()))
-
-		if len(songlist) > 0:
-			song = None
-			tries = 0
-			while song is None and tries < 3:
-				tries += 1
-				s = random.choice(songlist)
-				match = False
-				if self._blacklist is not None:
-					for item in self._blacklist:
-						if item.lower() == s.split(" - ", maxsplit=1)[0].lower():
-							match = True
-							print("INFO", "Found blacklist item '{}', tried {} times now".format(item, tries))
-							break
-				if not match: song = s
-
-			if song is not None:
-				self._last_random = (path, song)
-				self.play_song(path, song)
-				return "Playing: {}".format(get_displayname(song))
-			else: return "No song found that doesn't match something in blacklist, try reducing the number of blacklisted items"
+		songs, total = self._get_random_pool(path, keyword)
+		if len(songs) > 0:
+			next_random, self._next_random = self._next_random, None
+			song = next_random[1] if next_random is not None and next_random[0] is songs else random.choice(songs)
+			self._last_random = (path, song)
+			self.play_song(path, song)
+			return "Playing: {}".format(get_displayname(song))
+		elif total > 0: return "No song found that doesn't match something in blacklist, try reducing the number of blacklisted items"
 		return "No songs with that filter"
 
+	def peek_random_song(self, path="", keyword=""):
+		""" Pick the song the next call to 'random_song' with the same filter plays, as long as the filter and library don't change in the meantime
+		 	Returns a tuple (path, song) or None if there are no songs with the filter """
+		if path == "": path = self.filter_path
+		if keyword == "": keyword = self.filter_keyword
+
+		songs, total = self._get_random_pool(path, keyword)
+		if not songs: return None
+		if self._next_random is None or self._next_random[0] is not songs: self._next_random = (songs, random.choice(songs))
+		return path, self._next_random[1]
+
+	def peek_shuffle_song(self, path="", keyword=""):
+		""" Returns a tuple (path, song) with the song the next call to 'shuffle_song' with the same filter plays, or None if there are no songs with the filter """
+		if path == "": path = self.filter_path
+		if keyword == "": keyword = self.filter_keyword
+
+		song = self._shuffle_bag.peek((path, keyword), self._get_random_pool(path, keyword)[0])
+		return (path, song) if song is not None else None
+
+	def shuffle_song(self, path="", keyword=""):
+		""" Play the next song from the shuffle bag, no song is repeated until all songs matching the filter have been played
+			Uses values set in player filter when no arguments are given """
+		if path == "": path = self.filter_path
+		if keyword == "": keyword = self.filter_keyword
+
+		songs, total = self._get_random_pool(path, keyword)
+		song = self._shuffle_bag.draw((path, keyword), songs)
+		if song is not None:
+			print("VERBOSE", f"Play song from shuffle bag '{path}', keyword={keyword}, {self._shuffle_bag.remaining} remaining")
+			self._last_random = (path, song)
+			self.play_song(path, song)
+			return "Playing: {}".format(get_displayname(song))
+		elif total > 0: return "No song found that doesn't match something in blacklist, try reducing the number of blacklisted items"
+		return "No songs with that filter"
+
+	def _get_random_pool(self, path, keyword):
+		""" Returns the list of songs random songs are picked from for given path and keyword and the number of songs found before the blacklist was applied
+		 	The list is kept until the filter, blacklist or the library contents change """
+		pool = self._random_pool
+		if pool is None or pool[0] != (path, keyword):
+			songs = dict.fromkeys(itertools.chain.from_iterable(self.list_songs(path, word.strip()) for word in keyword.split("|")))
+			blacklist = self._get_blacklist()
+			if blacklist:
+				index = self._library.get_index(path)
+				eligible = [song for song in songs if not self._is_blacklisted(index, path, song, blacklist)]
+			else: eligible = list(songs)
+			print("VERBOSE", f"Created random song pool with {len(eligible)} songs ({len(songs) - len(eligible)} blacklisted)")
+			# the set of eligible songs is only needed to check whether a metadata update affects the pool, which can only happen with a blacklist
+			self._random_pool = pool = ((path, keyword), eligible, len(songs), frozenset(eligible) if blacklist else None)
+		return pool[1], pool[2]
+
+	def _get_blacklist(self):
+		return {item.lower() for item in self._blacklist} if self._blacklist else set()
+
+	def _is_blacklisted(self, index, path, song, blacklist):
+		if song.split(" - ", maxsplit=1)[0].lower() in blacklist: return True
+		return self._is_artist_blacklisted(self._get_index_metadata(index, path, song), blacklist)
+
+	@staticmethod
+	def _is_artist_blacklisted(metadata, blacklist):
+		return metadata is not None and metadata.artist is not None and metadata.artist.lower() in blacklist
+
 	def play_last_random(self):
 		if self._last_random is not None:
 			return self.play_song(self._last_random[0], self._last_random[1])
@@ -307,10 +552,34 @@ class MediaPlayer:
 		else: print("INFO", "Tried to register unknown event handler id '" + event + "', ignoring this call...")
 
 	def call_attached_handlers(self, name, event):
-		if name in self._events:
-			for cb in self._events[name][2]:
+		""" Queue an event for the handlers attached to it, they are called on the event thread so this returns immediately """
+		if name in self._events and self._events[name][2]:
+			self._event_queue.put((name, event if isinstance(event, DynamicClass) else MediaPlayerEvent(event.type, self._media_data)))
+
+	@property
+	def handler_timings(self):
+		""" Returns a dictionary with for every handler that was called a tuple (number of calls, total time, longest time) with the times in seconds """
+		return {key: tuple(timing) for key, timing in list(self._handler_timings.items())}
+
+	def _dispatch_events(self):
+		while True:
+			item = self._event_queue.get()
+			if item is None: return
+
+			name, event = item
+			for cb in list(self._events[name][2]):
+				start = time.perf_counter()
 				try: cb(event, self)
 				except Exception as e: print("ERROR", f"Calling event handler '{name}':", e)
+				elapsed = time.perf_counter() - start
+
+				key = f"{name}: {getattr(cb, '__module__', '')}.{getattr(cb, '__qualname__', cb)}"
+				timing = self._handler_timings.get(key)
+				if timing is None: timing = self._handler_timings[key] = [0, 0.0, 0.0]
+				timing[0] += 1
+				timing[1] += elapsed
+				timing[2] = max(timing[2], elapsed)
+				if elapsed > self.slow_handler_time: print("WARNING", f"Player event handler '{key}' took {elapsed * 1000:.0f}ms")
 
 	def on_song_end(self, event, name, player, player_one):
 		if not self._updated:
@@ -326,11 +595,66 @@ class MediaPlayer:
 		if (self._player_one == self._updated) == player_one:
 			pos = player.get_position()
 			self._last_position = pos
-			if self._updated and pos > MediaPlayer.end_pos:
+			crossfade = self._is_crossfade_time(player, pos)
+			if self._updated and (pos > MediaPlayer.end_pos or crossfade):
 				self._player_one = not self._player_one
 				self._updated = False
 				self.call_attached_handlers("player_updated", MediaPlayerEventUpdate(self._media_data))
-			self.call_attached_handlers(name, event)
+			if crossfade and not self._updated and not self._crossfade_started:
+				self._crossfade_started = True
+				self.call_attached_handlers("crossfade", MediaPlayerEventUpdate(self._media_data))
+			if self._should_publish_position(pos): self.call_attached_handlers(name, MediaPlayerEvent(event.type, self._media_data, position=pos))
+
+	def _should_publish_position(self, pos):
+		""" Check whether a position change should be passed to the handlers and update the counters """
+		counts = self._position_events
+		counts["received"] += 1
+		now = time.monotonic()
+		last_time, last_pos = self._published_position
+		if abs(pos - last_pos) < self.position_step: counts["unchanged"] += 1
+		# while paused no newer position follows, so changes that arrive after pausing are never held back
+		elif now - last_time < 1 / self.position_rate and not self._paused: counts["rate_limited"] += 1
+		else:
+			counts["published"] += 1
+			self._published_position = (now, pos)
+			return True
+		return False
+
+	def _publish_last_position(self):
+		""" Pass the last known position to the handlers if it was held back by the rate limit """
+		pos = self._last_position
+		if self._media_data is not None and abs(pos - self._published_position[1]) >= self.position_step:
+			self._position_events["published"] += 1
+			self._published_position = (time.monotonic(), pos)
+			self.call_attached_handlers("pos_changed", MediaPlayerEvent(self._events["pos_changed"][0], self._media_data, position=pos))
+
+	def _is_crossfade_time(self, player, pos):
+		""" Returns True if the song on given player is close enough to its end to start the next song
+		 	Songs shorter than the crossfade are never crossfaded and the next song is never started before halfway through a song,
+		 	otherwise short songs (like intros) would be skipped as soon as they start """
+		duration, start = self._crossfade[0], self._crossfade[1]
+		if duration <= 0 or start <= 0: return False
+		length = player.get_length()
+		return length >= duration * 1000 and (1 - pos) * length <= min(start * 1000, length / 2)
+
+	def _on_library_update(self, update):
+		self._metadata.analyze(update.path, update.added + update.updated)
+		pool = self._random_pool
+		if pool is not None and path_key(pool[0][0]) == path_key(update.path): self._random_pool = None
+
+	def _on_metadata_update(self, files):
+		# only an eligible song in the pool that turns out to be from a blacklisted artist changes the pool,
+		# this is checked for every file since most updates (like measuring the loudness) don't change the artist
+		pool = self._random_pool
+		if pool is None or pool[3] is None: return
+		blacklist = self._get_blacklist()
+		path, key = pool[0][0], path_key(pool[0][0])
+		index = self._library.get_index(path)
+		for file in files:
+			directory, song = os.path.split(file)
+			if song in pool[3] and path_key(directory) == key and self._is_artist_blacklisted(self._get_index_metadata(index, path, song), blacklist):
+				self._random_pool = None
+				return
 
 	def on_update(self, event, name, player, player_one):
 		self.call_attached_handlers(name, event)
@@ -338,6 +662,13 @@ class MediaPlayer:
 # ====== DESTROY PLAYER INSTANCE =====
 	def on_destroy(self):
 		print("VERBOSE", "Looks like we're done here, release all player stuffs")
+		print("VERBOSE", "Position change events:", ", ".join(f"{count} {key}" for key, count in self._position_events.items()))
+		self._event_queue.put(None)
+		self._event_thread.join(1)
+		self._library.close()
+		self._metadata.close()
+		self._crossfader.cancel()
+		if self._prepared is not None: self._prepared[1].release()
 		self._player1.release()
 		self._player2.release()
 		self._vlc.release()
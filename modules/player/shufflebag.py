@@ -0,0 +1,111 @@
+import json, random
+
+class ShuffleBag:
+	"""
+	 Draws songs from a pool in random order without repeating a song until every song in the pool was drawn
+	 The bag is a precomputed permutation of the pool with a cursor pointing to the next song,
+	 when the songs in the pool change the songs that weren't drawn yet are updated without reshuffling the whole bag
+	 When a file is given, the bag is saved to it and the cursor to a separate file so it can be resumed after a restart
+	"""
+	def __init__(self, file=None):
+		self._file = file
+		self._cursor_file = file + "_cursor" if file is not None else None
+		self._key = None
+		self._songs = []
+		self._cursor = 0
+		self._source = None
+		self._loaded = file is None
+
+	@property
+	def remaining(self):
+		""" The number of songs that can be drawn before the bag is reshuffled """
+		return len(self._songs) - self._cursor
+
+	def draw(self, key, pool):
+		"""
+		 Returns the next song from the bag for given key (identifying the filter used) and pool of songs
+		 When the pool differs from the one used previously, the bag is updated first
+		 Returns None if the pool is empty
+		"""
+		self._update(key, pool)
+		if not self._songs: return None
+
+		song = self._songs[self._cursor]
+		self._cursor += 1
+		self._save_cursor()
+		return song
+
+	def peek(self, key, pool):
+		""" Returns the song the next call to 'draw' with the same key and pool returns without taking it from the bag, or None if the pool is empty """
+		self._update(key, pool)
+		return self._songs[self._cursor] if self._songs else None
+
+	def _update(self, key, pool):
+		if not self._loaded: self._load()
+		if pool is not self._source: self._refill(key, pool)
+		if self._cursor >= len(self._songs): self._reshuffle()
+
+	def _refill(self, key, pool):
+		eligible = set(pool)
+		# a new pool with the same songs (like after the blacklist or library changed without affecting this filter) leaves the bag as it is
+		if key == self._key and len(eligible) == len(self._songs) and eligible.issuperset(self._songs):
+			self._source = pool
+			return
+
+		# the songs that were played are only kept for the same filter, a different filter starts with all its songs remaining
+		played = self._songs[:self._cursor] if key == self._key else []
+		played = [song for song in played if song in eligible]
+		remaining = [song for song in self._songs[self._cursor:] if song in eligible]
+
+		known = set(played)
+		known.update(remaining)
+		start = len(remaining)
+		remaining.extend(song for song in pool if song not in known)
+		for i in range(start, len(remaining)):
+			j = random.randint(0, i)
+			remaining[i], remaining[j] = remaining[j], remaining[i]
+
+		print("VERBOSE", f"Shuffle bag updated: {len(remaining) - start} songs added, {len(remaining)} remaining")
+		self._key, self._source = key, pool
+		self._songs, self._cursor = played + remaining, len(played)
+		self._save()
+
+	def _reshuffle(self):
+		last = self._songs[-1] if self._songs else None
+		self._songs = list(self._source) if self._source is not None else []
+		random.shuffle(self._songs)
+		if len(self._songs) > 1 and self._songs[0] == last:
+			j = random.randint(1, len(self._songs) - 1)
+			self._songs[0], self._songs[j] = self._songs[j], self._songs[0]
+
+		print("VERBOSE", f"Shuffle bag refilled with {len(self._songs)} songs")
+		self._cursor = 0
+		self._save()
+
+	def _load(self):
+		self._loaded = True
+		try:
+			with open(self._file, "r") as file: data = json.load(file)
+			self._key, self._songs = tuple(data["filter"]), data["songs"]
+			with open(self._cursor_file, "r") as file: self._cursor = min(int(file.read()), len(self._songs))
+			print("VERBOSE", f"Resuming shuffle bag with {self.remaining} songs remaining")
+		except FileNotFoundError: pass
+		except (ValueError, KeyError, TypeError) as e:
+			print("WARNING", "Invalid shuffle bag file, a new one will be created:", e)
+			self._key, self._songs, self._cursor = None, [], 0
+
+	def _save(self):
+		if self._file is not None:
+			try:
+				with open(self._file, "w") as file: json.dump({"filter": self._key, "songs": self._songs}, file)
+			except OSError as e: print("ERROR", "Saving shuffle bag:", e)
+			self._save_cursor()
+
+	def _save_cursor(self):
+		if self._cursor_file is not None:
+			try:
+				with open(self._cursor_file, "w") as file: file.write(str(self._cursor))
+			except OSError as e: print("ERROR", "Saving shuffle bag position:", e)
+
+	def __len__(self): return len(self._songs)
+	def __str__(self): return f"ShuffleBag[song_count={len(self._songs)}, remaining={self.remaining}]"
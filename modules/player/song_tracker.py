@@ -1,63 +1,219 @@
 from datetime import datetime
-from collections import Counter
-import calendar, os
+import calendar, json, os, threading, time
 
+from core.persistence import persistence_service, write_atomic
+from .songcatalog import PlayCounter, song_catalog
+
+# Every play is appended to the event log of the current month ('<month file>.log'),
+# the month file contains a snapshot of the play counts and the position in the log it was made at
+# Plays are buffered and written to the log in the background by the persistence service
+# In memory all counts are kept in a PlayCounter indexed by the song id from the song catalog, names are only used in files
 tracker = None
 tracker_file = ""
 is_dirty = False
 listeners = []
+compact_interval = 100
+
+_log = None
+_log_offset = 0
+_pending = 0
+_header = "%log%"
+_events = []
+_lock = threading.Lock()
+_flush_lock = threading.RLock()
+
+# The all-time play counts are the sum of the counts of every past month and the current tracker,
+# the counts of past months are cached in 'alltime_file' and only read again when their month file or log is modified
+alltime_file = "statistics/alltime.cache"
+_months = None
+_alltime = None
 
 def is_loaded():
 	return tracker is not None
 
+def get_log_file(file):
+	""" Returns the event log file belonging to given month file """
+	return file + ".log"
+
 def load_tracker():
-	global tracker, tracker_file, is_dirty
+	global tracker, tracker_file, is_dirty, _log, _log_offset, _pending, _alltime
 	m = datetime.today()
-	tracker_file = "statistics/" + calendar.month_name[m.month].lower() + str(m.year)
-	tracker = load_file(tracker_file)
-	is_dirty = False
+	# the persistence service cannot write to the log while it is replaced
+	with _flush_lock:
+		if _log is not None: flush()
+		file = "statistics/" + calendar.month_name[m.month].lower() + str(m.year)
+		counts, snapshot_offset, log_size, replayed = read_month(file)
+		log = open(get_log_file(file), "ab", buffering=0)
+		log_offset = log.tell()
+		if log_offset > log_size:
+			print("WARNING", f"Removing incomplete event at the end of the event log of '{file}'")
+			log.truncate(log_size)
+			log_offset = log_size
 
-def load_file(file):
-	global tracker_file
+		with _lock:
+			# plays added while the month was read are written to the new log, so they are counted in the new tracker as well
+			for event in _events:
+				timestamp, count, song = event.decode()[:-1].split("%", maxsplit=2)
+				counts.add(song_catalog.get_song_id(song), int(count))
+			old_log, _log = _log, log
+			tracker, tracker_file, _log_offset, _pending = counts, file, log_offset, replayed
+			is_dirty = _log_offset != snapshot_offset or len(_events) > 0
+			_alltime = None
+		if old_log is not None: old_log.close()
+
+		if _pending > 0: print("INFO", f"Replayed {_pending} play(s) from the event log of '{tracker_file}'")
+		if is_dirty: save_tracker()
+
+def read_month(file):
+	"""
+	 Read the play counts of a month: the snapshot in the month file with all events logged after it was made
+	 Returns a tuple (play counter, log position of the snapshot, size of the log, number of events replayed)
+	"""
 	if not os.path.isdir("statistics"): os.mkdir("statistics")
-	if not file.startswith("statistics/"): tracker_file = "statistics/" + file
-	c = Counter()
+	if not file.startswith("statistics/"): file = "statistics/" + file
+	c = PlayCounter()
+	offset = 0
+	try:
+		with open(file, "r") as d:
+			for item in d:
+				if item.startswith(_header):
+					try: offset = int(item[len(_header):])
+					except ValueError: pass
+					continue
+				item = item.replace("\n", "").split("%", maxsplit=1)
+				if len(item) == 2:
+					try: c[song_catalog.get_song_id(item[0])] = int(item[1])
+					except ValueError: pass
+	except FileNotFoundError: open(file, "w+").close()
+
+	size, replayed = offset, 0
+	for size, event in _read_log(file, offset):
+		if event is not None:
+			c.add(song_catalog.get_song_id(event[2]), event[1])
+			replayed += 1
+	return c, offset, size, replayed
+
+def _read_log(file, offset=0):
+	""" Yields a tuple (position after the event, event) for every complete event in the log of given month file, where event is a tuple (timestamp, count, song) or None if it is invalid """
 	try:
-		d = open(tracker_file, "r")
-		for item in d:
-			item = item.replace("\n", "").split("%", maxsplit=1)
-			if len(item) == 2:
-				try: c[item[0]] = int(item[1])
-				except ValueError: pass
-		d.close()
-	except FileNotFoundError: open(tracker_file, "w+").close()
-	return c
+		with open(get_log_file(file), "rb") as log:
+			log.seek(offset)
+			for line in log:
+				if not line.endswith(b"\n"): break
+				offset += len(line)
+				event = line.decode(errors="replace")[:-1].split("%", maxsplit=2)
+				try: yield offset, (int(event[0]), int(event[1]), event[2])
+				except (IndexError, ValueError): yield offset, None
+	except FileNotFoundError: pass
+
+def read_events(file):
+	""" Returns all play events logged in given month file as a list of tuples (timestamp, count, song) """
+	if not file.startswith("statistics/"): file = "statistics/" + file
+	return [event for offset, event in _read_log(file) if event is not None]
+
+def load_file(file):
+	""" Returns the play counts of the given month file """
+	return read_month(file)[0]
 
 def save_tracker():
-	global tracker, tracker_file, is_dirty
-	if is_dirty:
-		file = open(tracker_file, "w")
-		for item, count in tracker.items():
-			file.write(item + "%" + str(count) + "\n")
-		file.close()
-	is_dirty = False
+	""" Write all buffered plays to the event log and compact it into the month file """
+	_flush(compact=True)
+
+def flush():
+	""" Write all buffered plays to the event log, the log is compacted into the month file every 'compact_interval' plays """
+	_flush(compact=False)
+
+def _flush(compact):
+	global is_dirty, _log_offset, _pending
+	with _flush_lock:
+		with _lock:
+			data = b"".join(_events)
+			_pending += len(_events)
+			_events.clear()
+			compact = is_dirty and (compact or _pending >= compact_interval)
+			counts = list(tracker.items()) if compact else None
+			is_dirty = is_dirty and not compact
+
+		if data:
+			_log.write(data)
+			_log_offset += len(data)
+		if compact:
+			# the copied counts include exactly the plays written to the log so far
+			write_atomic(tracker_file, _header + str(_log_offset) + "\n" + "".join(song_catalog.get_song_name(song_id) + "%" + str(count) + "\n" for song_id, count in counts))
+			_pending = 0
 
 def add(song, n=1):
-	global tracker, is_dirty
-	tracker[song] += n
-	is_dirty = True
-	save_tracker()
+	global is_dirty
+	song_id = song_catalog.get_song_id(song)
+	with _lock:
+		_events.append(f"{int(time.time())}%{n}%{song}\n".encode())
+		tracker.add(song_id, n)
+		if _alltime is not None: _alltime.add(song_id, n)
+		is_dirty = True
+	persistence_service.schedule(flush)
 	for l in listeners: l(song, n)
 
+def is_month_file(file):
+	""" Returns True if given file in the statistics directory contains the play counts of a month """
+	return file != "player" and "." not in file
+
 def get_songlist(alltime=False):
 	if not alltime: return tracker
+	return get_alltime()
+
+def get_alltime():
+	""" Returns the play counts of all months combined, only months that were modified since they were last read are read again """
+	global _months, _alltime
+	if _months is None: _months = load_alltime_cache()
 
-	songlist = Counter()
+	current = os.path.basename(tracker_file)
+	changed = []
+	found = set()
 	for item in os.listdir("statistics"):
-		if item != "player": songlist.update(load_file(item))
-	return songlist
+		if not is_month_file(item) or item == current: continue
+		found.add(item)
+		stamp = get_stamp(item)
+		month = _months.get(item)
+		if month is None or month[0] != stamp:
+			print("VERBOSE", f"Reading play counts of '{item}' for all-time statistics")
+			_months[item] = (stamp, load_file(item))
+			changed.append((month[1] if month is not None else PlayCounter(), _months[item][1]))
+	for item in set(_months.keys()) - found: changed.append((_months.pop(item)[1], PlayCounter()))
+
+	if changed: save_alltime_cache()
+	if _alltime is None:
+		alltime = PlayCounter()
+		for stamp, counts in _months.values(): alltime.update(counts)
+		with _lock:
+			alltime.update(tracker)
+			_alltime = alltime
+	else:
+		for old, new in changed:
+			_alltime.subtract(old)
+			_alltime.update(new)
+	return _alltime
+
+def get_stamp(file):
+	""" Returns the modification times of given month file and its event log, used to check whether it changed """
+	file = "statistics/" + file
+	stamp = []
+	for f in (file, get_log_file(file)):
+		try: stamp.append(os.stat(f).st_mtime_ns)
+		except FileNotFoundError: stamp.append(0)
+	return stamp
+
+def load_alltime_cache():
+	try:
+		with open(alltime_file, "r") as file:
+			return {item: (data["stamp"], PlayCounter((song_catalog.get_song_id(song), count) for song, count in data["counts"].items())) for item, data in json.load(file).items()}
+	except FileNotFoundError: pass
+	except (ValueError, KeyError, TypeError, AttributeError) as e: print("WARNING", "Invalid all-time statistics cache, it will be created again:", e)
+	return {}
+
+def save_alltime_cache():
+	try: write_atomic(alltime_file, json.dumps({item: {"stamp": stamp, "counts": {song_catalog.get_song_name(song_id): count for song_id, count in counts.items()}} for item, (stamp, counts) in _months.items()}))
+	except OSError as e: print("ERROR", "Saving all-time statistics cache:", e)
 
 def get_freq(song, alltime=False):
-	ls = get_songlist(alltime)
-	if song in ls: return ls[song]
-	else: return 0
\ No newline at end of file
+	""" Returns the number of times the song with given display name was played this month or overall """
+	return get_songlist(alltime)[song_catalog.find_song_id(song)]
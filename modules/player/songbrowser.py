@@ -1,26 +1,80 @@
 import os
 
-from collections import Counter
-from ui.qt import pyelement
+from ui.qt import pyelement, pyworker
 from core import messagetypes, modules
-from modules.player import song_tracker
+from modules.player import song_tracker, songlibrary
+from modules.player.songcatalog import PlayCounter, song_catalog
 module = modules.Module(__package__)
 
 # VARIABLES SPECIFIC TO THIS MODULE
 default_path_key = "default_directory"
 default_sort_key = "songbrowser_sorting"
 
-def get_songlist(path): return [os.path.splitext(entry.name)[0] for entry in os.scandir(path) if entry.is_file()]
+def get_entries(path):
+	index = module.media_player.library.get_index(path)
+	return index.entries if index is not None else []
+def get_songlist(path): return [entry.display_name for entry in get_entries(path)]
+
+class SongRanking:
+	"""
+	 Keeps song ids ordered by their play count, from most to least played, together with the row of every song
+	 Songs with the same count form a bucket and the first row of every bucket is kept,
+	 when the count of a song increases it is swapped with the first song of every bucket it passes instead of sorting all songs again
+	"""
+	def __init__(self, counter, songs):
+		self.counter = counter
+		self.items = sorted(songs, key=counter.__getitem__, reverse=True)
+		self._rows = {song_id: row for row, song_id in enumerate(self.items)}
+		self._starts = {}
+		for row in range(len(self.items) - 1, -1, -1): self._starts[counter[self.items[row]]] = row
+
+	def row(self, song_id):
+		""" Returns the row of given song or -1 if it isn't in this ranking """
+		return self._rows.get(song_id, -1)
+
+	def append(self, song_id):
+		""" Add a song that wasn't played yet at the end, returns its row """
+		row = len(self.items)
+		self.items.append(song_id)
+		self._rows[song_id] = row
+		if row == 0 or self.counter[self.items[row - 1]] != 0: self._starts[0] = row
+		return row
+
+	def add(self, song_id, n=1):
+		""" Increase the count of given song by 'n' (must be positive) and move it up to its new place, returns the rows that changed """
+		items, rows, starts, counter = self.items, self._rows, self._starts, self.counter
+		row, count = rows[song_id], counter[song_id]
+		counter.add(song_id, n)
+		new_count = counter[song_id]
+		changed = []
+		while True:
+			start = starts[count]
+			if start != row:
+				items[row], items[start] = items[start], song_id
+				rows[items[row]], rows[song_id] = row, start
+				changed.extend((start, row))
+				row = start
+			# the song left its bucket from the top, so that bucket starts one row later now (or is gone)
+			if row + 1 < len(items) and counter[items[row + 1]] == count: starts[count] = row + 1
+			else: del starts[count]
+			# the song is now directly below the songs from the next bucket
+			count = counter[items[row - 1]] if row > 0 else new_count
+			if count >= new_count: break
+
+		if row == 0 or count != new_count: starts[new_count] = row
+		return changed
 class SongBrowser(pyelement.PyItemlist):
 	""" Can list all items (songs) from a directory in a specified order
 		possible orderings: frequency(counter), creation time, name
+		When sorted on frequency or creation time, songs are kept by their id in the song catalog and only resolved to their name for the list
 	"""
 	element_id = "songbrowser"
 
 	def __init__(self, parent):
 		pyelement.PyItemlist.__init__(self, parent, self.element_id)
-		self._path = self._songcounter = None
-		self._path_valid = self._is_dynamic = False
+		self._path = self._songcounter = self._songs = self._ranking = None
+		self._rows = {}
+		self._path_valid = self._is_dynamic = self._loading = False
 		self.selection_mode = "none"
 		self.auto_select = False
 
@@ -36,58 +90,94 @@ class SongBrowser(pyelement.PyItemlist):
 		elif isinstance(path, str): self._path = (path, path if path.endswith("/") else path + "/")
 		else: self._path = None
 
+		self._songs = self._songcounter = self._ranking = None
+		self._is_dynamic = False
 		self._path_valid = self._path is not None and os.path.isdir(self._path[1])
-		if not self._path_valid: self.itemlist = [(0, "Invalid path selected: " + str(self._path))]
+		if not self._path_valid: self._set_itemlist(["Invalid path selected: " + str(self._path)])
 
-	def select_song(self, song):
-		index = -1
-		found = False
-		for s in self.itemlist:
-			if s == song: index = max(0, index + 1); found = True; break
-			else: index += 1
+	@property
+	def path_valid(self): return self._path_valid
 
-		if found:
+	def _set_itemlist(self, items, display=str):
+		self.set_items(items, display)
+		self._rows = {items[row]: row for row in range(len(items) - 1, -1, -1)} if self._ranking is None else None
+
+	def _find_row(self, song):
+		if self._ranking is not None: return self._ranking.row(song_catalog.find_song_id(song))
+		return self._rows.get(song_catalog.find_song_id(song) if self._songs is not None else song, -1)
+
+	def select_song(self, song):
+		index = self._find_row(song)
+		if index >= 0:
 			self.set_selection(index=index)
 			self.move_to(index)
 		else: self.clear_selection()
 
-	def create_list_from_frequency(self, path, songcounter):
-		self.path = path
-		if self._path_valid:
-			self._is_dynamic = True
-			self._songcounter = Counter()
-			for entry in os.scandir(self.path[1]):
-				if entry.is_file():
-					song = os.path.splitext(entry.name)[0]
-					self._songcounter[song] += songcounter[song]
-			self.itemlist = [i[0] for i in self._songcounter.most_common()]
-
-	def create_list_from_recent(self, path):
-		self.path = path
-		if self._path_valid:
-			self._songcounter = Counter()
-			for entry in os.scandir(self.path[1]):
-				if entry.is_file():
-					song = os.path.splitext(entry.name)[0]
-					self._songcounter[song] = entry.stat().st_ctime
-			self.itemlist = [i[0] for i in self._songcounter.most_common()]
-
-	def create_list_from_name(self, path):
-		self.path = path
-		if self._path_valid: self.itemlist = get_songlist(path[1])
-
-	def create_list_random(self, path):
-		self.path = path
-		if self._path_valid:
-			sl = get_songlist(path[1])
-			import random; random.shuffle(sl)
-			self.itemlist = sl
+	def show_loading(self):
+		""" Show a placeholder until the list built on another thread is shown with 'show_list' """
+		self._loading = True
+		self._set_itemlist(["Loading..."])
+
+	def show_list(self, items, display=str, songs=None, songcounter=None, ranking=None):
+		""" Show a list returned by one of the 'create_list' functions, must be called from the window thread """
+		self._songs, self._songcounter, self._ranking = songs, songcounter, ranking
+		self._is_dynamic = ranking is not None
+		self._loading = False
+		self._set_itemlist(items, display)
+
+	# The 'create_list' functions only read the library and build the ordered list, they can be called from any thread
+	# They return the keywords for 'show_list'
+	@staticmethod
+	def create_list_from_frequency(path, songcounter):
+		songs = dict.fromkeys(song_catalog.get_song_id(entry.display_name) for entry in get_entries(path[1]))
+		counter = PlayCounter((song_id, songcounter[song_id]) for song_id in songs)
+		ranking = SongRanking(counter, songs)
+		return dict(items=ranking.items, display=song_catalog.get_song_name, songs=songs, songcounter=counter, ranking=ranking)
+
+	@staticmethod
+	def create_list_from_recent(path):
+		ctimes = {song_catalog.get_song_id(entry.display_name): entry.ctime for entry in get_entries(path[1])}
+		return dict(items=sorted(ctimes, key=ctimes.__getitem__, reverse=True), display=song_catalog.get_song_name, songs=dict.fromkeys(ctimes), songcounter=ctimes)
+
+	@staticmethod
+	def create_list_from_name(path): return dict(items=get_songlist(path[1]))
+
+	@staticmethod
+	def create_list_random(path):
+		sl = get_songlist(path[1])
+		import random; random.shuffle(sl)
+		return dict(items=sl)
+
+	def update_songs(self, update):
+		""" Apply the changes from a library update to this browser, has no effect if the update is for a different directory """
+		if not self._path_valid or self._loading or songlibrary.path_key(update.path) != songlibrary.path_key(self.path[1]): return
+
+		removed = {entry.display_name for entry in update.removed}
+		if self._songcounter is not None:
+			for song in removed:
+				song_id = song_catalog.find_song_id(song)
+				if song_id is not None: self._songs.pop(song_id, None)
+			for entry in update.added:
+				song_id = song_catalog.get_song_id(entry.display_name)
+				self._songs[song_id] = None
+				if not self._is_dynamic: self._songcounter[song_id] = entry.ctime
+			self._update_itemlist()
+		else: self._set_itemlist([song for song in self.model.items if song not in removed] + [entry.display_name for entry in update.added])
+
+	def _update_itemlist(self):
+		if self._is_dynamic:
+			self._ranking = SongRanking(self._songcounter, self._songs)
+			self._set_itemlist(self._ranking.items, song_catalog.get_song_name)
+		else: self._set_itemlist(sorted(self._songs, key=self._songcounter.__getitem__, reverse=True), song_catalog.get_song_name)
 
 	def add_count(self, song, add=1):
 		if self._path_valid:
 			if self._is_dynamic:
-				self._songcounter[song] += add
-				self.itemlist = [i[0] for i in self._songcounter.most_common()]
+				song_id = song_catalog.get_song_id(song)
+				if song_id not in self._songs:
+					self._songs[song_id] = None
+					self.model.insert_item(self._ranking.append(song_id), song_id)
+				for row in self._ranking.add(song_id, add): self.model.set_item(row, self._ranking.items[row])
 				self.select_song(song)
 			return True
 		else: return False
@@ -116,7 +206,7 @@ def bind_events():
 
 		@browser.events.EventDoubleClickRight
 		def _browser_rightclick():
-			module.interpreter.put_command(f"queue {browser.path[0]} {browser.itemlist[browser.clicked_index].replace(' - ', ' ')}.")
+			module.interpreter.put_command(f"queue {browser.path[0]} {browser.model.text(browser.clicked_index).replace(' - ', ' ')}.")
 		browser.select_song(module.client.title_song)
 
 def title_update(data, color):
@@ -126,12 +216,36 @@ def unsupported_path(): print("INFO", "Tried to open songbrowser sorted on plays
 
 # ===== Songbrowser configuration =====
 _browser_types = [
-	lambda browser, *args: browser.create_list_from_name(*args),
-	lambda browser, *args: browser.create_list_random(*args),
-	lambda browser, *args: browser.create_list_from_recent(*args),
-	lambda browser, *args: browser.create_list_from_frequency(*args)
+	SongBrowser.create_list_from_name,
+	SongBrowser.create_list_random,
+	SongBrowser.create_list_from_recent,
+	SongBrowser.create_list_from_frequency
 ]
 
+class TaskBrowser(pyworker.PyWorker):
+	""" Builds the list for a song browser, the browser shows a placeholder until it is done """
+	def __init__(self, browser, build, args):
+		self._browser = browser
+		self._build = build
+		self._args = args
+		self._result = None
+		pyworker.PyWorker.__init__(self, module.client, "TaskBrowser")
+
+	def _is_shown(self):
+		try: return module.client["player"][SongBrowser.element_id] is self._browser
+		except KeyError: return False
+
+	def run(self): self._result = self._build(self._browser.path, *self._args)
+
+	def complete(self):
+		# the browser might have been closed or replaced while its list was built
+		if self._is_shown():
+			self._browser.show_list(**self._result)
+			self._browser.select_song(module.client.title_song)
+
+	def error(self, error):
+		if self._is_shown(): self._browser.show_list([f"Failed to load songs: {error}"])
+
 def set_songbrowser(browser):
 	if browser:
 		module.client.layout.item(module.client.layout.index_of("console"), weight=0)
@@ -153,9 +267,12 @@ def create_songbrowser(type, args=None):
 	if type < 0: return set_songbrowser(None)
 
 	try:
-		browser_cb = _browser_types[type]
+		build = _browser_types[type]
 		browser = SongBrowser(module.client["player"])
-		browser_cb(browser, *args)
+		browser.path = args[0]
+		if browser.path_valid:
+			browser.show_loading()
+			TaskBrowser(browser, build, args[1:])
 
 		set_songbrowser(browser)
 		bind_events()
@@ -220,6 +337,24 @@ def command_browser_remove(arg, argc):
 		module.client.schedule_task(task_id="songbrowser_create", type=-1)
 		return messagetypes.Reply("Browser closed")
 
+def on_library_update(update):
+	module.client.schedule_task(task_id="songbrowser_library_update", update=update)
+
+def _update_songbrowser(update):
+	try: module.client["player"][SongBrowser.element_id].update_songs(update)
+	except KeyError: pass
+
+def add_count(song):
+	""" Update the play count of given song in the browser, this can be called from any thread """
+	module.client.schedule_task(task_id="songbrowser_add_count", song=song)
+
+def _add_songbrowser_count(song):
+	try: module.client["player"][SongBrowser.element_id].add_count(song)
+	except KeyError: pass
+
 def initialize():
 	module.client.add_task(task_id="songbrowser_create", func=create_songbrowser)
+	module.client.add_task(task_id="songbrowser_library_update", func=_update_songbrowser)
+	module.client.add_task(task_id="songbrowser_add_count", func=_add_songbrowser_count)
+	module.media_player.library.add_listener(on_library_update)
 	module.configuration.get_or_create(default_sort_key, "name")
\ No newline at end of file
@@ -0,0 +1,114 @@
+import heapq, itertools, os, threading
+from array import array
+
+class SongCatalog:
+	"""
+	 Assigns an integer id to every song and song file, so they can be stored and compared as numbers and every name is only kept in memory once
+	 Songs are identified by their display name, files by the directory and filename
+	 Ids are assigned in order starting from 0 and are never reused while the program runs, they are not saved and should not be written to disk
+	"""
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._song_ids = {}
+		self._songs = []
+		self._file_ids = {}
+		self._files = []
+
+	def get_song_id(self, name):
+		""" Returns the id of the song with given display name, a new id is assigned if this song wasn't known yet """
+		song_id = self._song_ids.get(name)
+		if song_id is None:
+			with self._lock:
+				song_id = self._song_ids.get(name)
+				if song_id is None:
+					song_id = self._song_ids[name] = len(self._songs)
+					self._songs.append(name)
+		return song_id
+
+	def find_song_id(self, name):
+		""" Returns the id of the song with given display name or None if it wasn't assigned one """
+		return self._song_ids.get(name)
+
+	def get_song_name(self, song_id):
+		""" Returns the display name of the song with given id """
+		return self._songs[song_id]
+
+	def get_file_id(self, path, file):
+		""" Returns the id of given file in given directory, a new id is assigned if this file wasn't known yet """
+		file_id = self._file_ids.get((path, file))
+		if file_id is None:
+			song_id = self.get_song_id(os.path.splitext(file)[0])
+			with self._lock:
+				file_id = self._file_ids.get((path, file))
+				if file_id is None:
+					file_id = self._file_ids[(path, file)] = len(self._files)
+					self._files.append((path, file, song_id))
+		return file_id
+
+	def get_file(self, file_id):
+		""" Returns a tuple (path, filename) for the file with given id """
+		return self._files[file_id][:2]
+
+	def get_file_song(self, file_id):
+		""" Returns the id of the song that is stored in the file with given id """
+		return self._files[file_id][2]
+
+	def get_file_name(self, file_id):
+		""" Returns the display name of the song stored in the file with given id """
+		return self._songs[self._files[file_id][2]]
+
+	def __len__(self): return len(self._songs)
+	def __str__(self): return f"SongCatalog[song_count={len(self._songs)}, file_count={len(self._files)}]"
+
+class PlayCounter:
+	"""
+	 Number of plays for every song, indexed by song id
+	 The counts are stored in an array of integers where every song id is the index of its count, songs that aren't counted have a count of 0
+	"""
+	def __init__(self, counts=None):
+		self._counts = array("I")
+		if counts is not None: self.update(counts)
+
+	def _ensure(self, song_id):
+		if song_id >= len(self._counts): self._counts.extend(itertools.repeat(0, song_id + 1 - len(self._counts)))
+
+	def __getitem__(self, song_id):
+		return self._counts[song_id] if song_id is not None and 0 <= song_id < len(self._counts) else 0
+
+	def __setitem__(self, song_id, count):
+		self._ensure(song_id)
+		self._counts[song_id] = max(count, 0)
+
+	def add(self, song_id, n=1):
+		""" Increase the count of given song by n """
+		self._ensure(song_id)
+		self._counts[song_id] = max(self._counts[song_id] + n, 0)
+
+	def update(self, other):
+		""" Add all counts from another counter or iterable of tuples (song id, count) """
+		for song_id, count in (other.items() if isinstance(other, PlayCounter) else other): self.add(song_id, count)
+
+	def subtract(self, other):
+		""" Subtract all counts of another counter, counts never go below 0 """
+		for song_id, count in other.items(): self.add(song_id, -count)
+
+	def items(self):
+		""" Returns an iterator of tuples (song id, count) for every song that has a count higher than 0 """
+		return ((song_id, count) for song_id, count in enumerate(self._counts) if count > 0)
+
+	def most_common(self, n=None):
+		""" Returns a list of tuples (song id, count) of the 'n' songs with the highest count (or all songs when n is None), sorted from highest to lowest """
+		if n is None: return sorted(self.items(), key=lambda item: item[1], reverse=True)
+		return heapq.nlargest(n, self.items(), key=lambda item: item[1])
+
+	def copy(self):
+		res = PlayCounter()
+		res._counts = array("I", self._counts)
+		return res
+
+	def __contains__(self, song_id): return self[song_id] > 0
+	def __iter__(self): return (song_id for song_id, count in self.items())
+	def __len__(self): return sum(1 for count in self._counts if count > 0)
+	def __str__(self): return f"PlayCounter[song_count={len(self)}]"
+
+song_catalog = SongCatalog()
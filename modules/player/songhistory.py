@@ -3,10 +3,16 @@ from core import history, modules
 module = modules.Module(__package__)
 from ui.qt import pyelement, pywindow
 from . import songqueue
+from .songcatalog import song_catalog
+
+class SongHistory(history.History):
+    """ History of played songs, songs are stored by their file id in the song catalog and saved to file as [path, song] """
+    def _encode_item(self, item): return list(song_catalog.get_file(item))
+    def _decode_item(self, item): return song_catalog.get_file_id(*item)
 
 if not os.path.isdir(".cache"): os.mkdir(".cache")
 song_history_path = os.path.join(".cache", "songhistory")
-song_history = history.History(limit=100, file=song_history_path)
+song_history = SongHistory(limit=10000, file=song_history_path)
 
 historywindow_id = "songhistory_viewer"
 class SongHistoryViewer(history.HistoryViewer):
@@ -18,11 +24,11 @@ class SongHistoryViewer(history.HistoryViewer):
 
     def _on_history_update(self, new_history=None):
         if new_history is None: new_history = iter(self._history)
-        self["history_view"].itemlist = [module.get_displayname(i[1]) for i in new_history]
+        self["history_view"].set_items(list(new_history), song_catalog.get_file_name)
 
     def _on_item_click(self):
-        item = self._history[self["history_view"].clicked_index]
-        module.media_player.play_song(item[0], item[1])
+        path, song = song_catalog.get_file(self._history[self["history_view"].clicked_index])
+        module.media_player.play_song(path, song)
 
 class PlayerInfoWindow(pywindow.PyWindow):
     window_id = "player_info"
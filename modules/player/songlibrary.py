@@ -0,0 +1,566 @@
+import bisect, hashlib, heapq, itertools, os, stat, threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .songsnapshot import read_snapshot, write_snapshot
+from .songwatcher import LibraryWatcher
+
+SongEntry = namedtuple("SongEntry", ["file", "display_name", "keyword", "extension", "size", "mtime", "ctime"])
+LibraryUpdate = namedtuple("LibraryUpdate", ["path", "added", "removed", "updated"])
+
+def normalize_name(file):
+	""" Returns the name used for keyword matching: lowercase, without extension and with artist separator removed """
+	return os.path.splitext(file.replace(" - ", " ").lower())[0]
+
+def create_entry(file, st):
+	""" Create a new library entry for given filename and its stat result """
+	name, ext = os.path.splitext(file)
+	return SongEntry(file, name, normalize_name(file), ext.lower(), st.st_size, st.st_mtime, st.st_ctime)
+
+def get_dir_mtime(path):
+	""" Returns the modification time of given directory in nanoseconds or 0 if it cannot be read """
+	try: return os.stat(path).st_mtime_ns
+	except OSError: return 0
+
+def _entry_from_snapshot(file, keyword, size, mtime, ctime):
+	name, ext = os.path.splitext(file)
+	return SongEntry(file, name, keyword, ext.lower(), size, mtime, ctime)
+
+def get_trigrams(word):
+	""" Returns the set of all three letter sequences in given word, including the start and end of the word """
+	padded = f" {word} "
+	return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def path_key(path):
+	""" Returns the key used to identify given directory in the library """
+	return os.path.normcase(os.path.normpath(path))
+
+class TokenIndex:
+	"""
+	 Inverted index that maps every word (split on spaces) of the normalized song names to the files that contain it
+	 Results are returned in the order files were added to the index
+	 For typo tolerant searching all words are indexed on their trigrams as well, this index is only built the first time it is needed
+	"""
+	max_similar_words = 20
+	min_word_similarity = 0.4
+
+	def __init__(self):
+		self._postings = {}
+		self._trigrams = None
+		self._order = {}
+		self._counter = 0
+		self._vocabulary = None
+
+	def add(self, file, keyword):
+		""" Add a file with its normalized name to the index """
+		if file not in self._order:
+			self._order[file] = self._counter
+			self._counter += 1
+
+		for token in set(keyword.split(" ")):
+			posting = self._postings.get(token)
+			if posting is None:
+				self._postings[token] = posting = set()
+				self._vocabulary = None
+				if self._trigrams is not None:
+					for trigram in get_trigrams(token): self._trigrams.setdefault(trigram, set()).add(token)
+			posting.add(file)
+
+	def add_all(self, entries):
+		""" Add all given library entries at once, faster than adding them one by one """
+		postings, order = self._postings, self._order
+		new_tokens = []
+		for entry in entries:
+			if entry.file not in order:
+				order[entry.file] = self._counter
+				self._counter += 1
+			for token in entry.keyword.split(" "):
+				posting = postings.get(token)
+				if posting is None:
+					postings[token] = posting = set()
+					new_tokens.append(token)
+				posting.add(entry.file)
+
+		if new_tokens:
+			self._vocabulary = None
+			if self._trigrams is not None: self._add_trigrams(new_tokens)
+
+	def _add_trigrams(self, tokens):
+		trigrams = self._trigrams
+		for token in tokens:
+			for trigram in get_trigrams(token): trigrams.setdefault(trigram, set()).add(token)
+
+	def remove(self, file, keyword):
+		""" Remove a file with its normalized name from the index """
+		self._order.pop(file, None)
+		for token in set(keyword.split(" ")):
+			posting = self._postings.get(token)
+			if posting is not None:
+				posting.discard(file)
+				if not posting:
+					del self._postings[token]
+					self._vocabulary = None
+					if self._trigrams is None: continue
+					for trigram in get_trigrams(token):
+						words = self._trigrams.get(trigram)
+						if words is not None:
+							words.discard(token)
+							if not words: del self._trigrams[trigram]
+
+	@property
+	def vocabulary(self):
+		""" Sorted list of all words in the index """
+		if self._vocabulary is None: self._vocabulary = sorted(self._postings.keys())
+		return self._vocabulary
+
+	def lookup(self, token):
+		""" Returns all files containing the full word """
+		return self._postings.get(token, frozenset())
+
+	def lookup_prefix(self, prefix):
+		""" Returns all files containing a word starting with given prefix """
+		vocabulary = self.vocabulary
+		res = set()
+		for token in itertools.islice(vocabulary, bisect.bisect_left(vocabulary, prefix), None):
+			if not token.startswith(prefix): break
+			res.update(self._postings[token])
+		return res
+
+	def lookup_suffix(self, suffix):
+		""" Returns all files containing a word ending with given suffix """
+		res = set()
+		for token, posting in self._postings.items():
+			if token.endswith(suffix): res.update(posting)
+		return res
+
+	def lookup_substring(self, text):
+		""" Returns all files containing a word that contains given text """
+		res = set()
+		for token, posting in self._postings.items():
+			if text in token: res.update(posting)
+		return res
+
+	def find_words(self, words):
+		""" Returns all files that contain every given word as a full word """
+		return _intersect([self.lookup(word) for word in words])
+
+	def find_fragment(self, words):
+		"""
+		 Returns all files that could contain the given words as a substring:
+		 the first word may be the end of a word, the last word the start of one and all words in between must be full words
+		"""
+		if len(words) == 1: return self.lookup_substring(words[0])
+		return _intersect([self.lookup(word) for word in words[1:-1]] + [self.lookup_prefix(words[-1]), self.lookup_suffix(words[0])])
+
+	def similar_words(self, word):
+		"""
+		 Returns the words in the index that look like given word as a list of tuples: (word, similarity)
+		 Similarity is the dice coefficient of their trigrams, words starting with the given word are always considered similar
+		"""
+		if self._trigrams is None:
+			self._trigrams = {}
+			self._add_trigrams(self._postings)
+
+		trigrams = get_trigrams(word)
+		counts = Counter()
+		for trigram in trigrams: counts.update(self._trigrams.get(trigram, ()))
+
+		res = []
+		for token, common in counts.items():
+			similarity = 2 * common / (len(trigrams) + len(token))
+			if token.startswith(word): similarity = max(similarity, 0.9)
+			if similarity >= self.min_word_similarity: res.append((token, similarity))
+		return heapq.nlargest(self.max_similar_words, res, key=lambda item: item[1])
+
+	def find_similar(self, words, limit, min_score):
+		"""
+		 Returns up to 'limit' files that best match the given words, even if they aren't spelled exactly the same
+		 Every file is scored on the average similarity of its best matching word for each of the given words
+		 -> Returns a list of tuples (file, score) sorted on score, only including files with a score of at least 'min_score'
+		"""
+		words = [word for word in words if word]
+		if not words: return []
+
+		scores = Counter()
+		for word in words:
+			best = {}
+			for token, similarity in self.similar_words(word):
+				for file in self._postings[token]:
+					if best.get(file, 0) < similarity: best[file] = similarity
+			scores.update(best)
+
+		min_total = min_score * len(words)
+		ranked = heapq.nlargest(limit, (item for item in scores.items() if item[1] >= min_total), key=lambda item: (item[1], -self._order[item[0]]))
+		return [(file, score / len(words)) for file, score in ranked]
+
+	def sort(self, files):
+		""" Returns the given files sorted on the order they were added """
+		return sorted(files, key=self._order.__getitem__)
+
+	def __len__(self): return len(self._order)
+
+def _intersect(postings):
+	postings = sorted(postings, key=len)
+	res = set(postings[0])
+	for posting in postings[1:]:
+		if not res: break
+		res.intersection_update(posting)
+	return res
+
+class DirectoryIndex:
+	"""
+	 In-memory listing of all files in a single directory
+	 The directory is only scanned the first time it is needed (or when explicitly refreshed), all lookups are answered from memory
+	 When a snapshot file is given, the index is loaded from it instead of scanning the directory
+	"""
+	def __init__(self, path, snapshot_file=None):
+		self._path = path
+		self._entries = {}
+		self._tokens = TokenIndex()
+		self._loaded = False
+		self._lock = threading.RLock()
+		self._snapshot_file = snapshot_file
+		self._dir_mtime = 0
+		self._dirty = False
+		self._needs_validation = False
+
+	@property
+	def path(self):
+		""" The directory this index was created for """
+		return self._path
+	@property
+	def loaded(self):
+		""" True if the directory has been scanned at least once """
+		return self._loaded
+	@property
+	def needs_validation(self):
+		""" True if the index was loaded from a snapshot and it hasn't been compared to the directory contents yet """
+		return self._needs_validation
+
+	def ensure_loaded(self):
+		""" Load the snapshot or scan the directory if this hasn't happened yet, returns this index """
+		if not self._loaded:
+			with self._lock:
+				if not self._loaded and not self._load_snapshot():
+					self.rebuild()
+					self.save_snapshot()
+		return self
+
+	def _load_snapshot(self):
+		if self._snapshot_file is None: return False
+		snapshot = read_snapshot(self._snapshot_file, _entry_from_snapshot)
+		if snapshot is None: return False
+
+		self._dir_mtime, entries = snapshot
+		self._entries = {entry.file: entry for entry in entries}
+		self._tokens = TokenIndex()
+		self._tokens.add_all(entries)
+		self._loaded = self._needs_validation = True
+		print("VERBOSE", f"Library index for '{self._path}' loaded from snapshot with {len(entries)} songs")
+		return True
+
+	def validate(self):
+		"""
+		 Compare an index loaded from a snapshot to the directory contents, the directory is only listed when it was modified after the snapshot was made
+		 Returns a tuple of lists containing the added, removed and updated entries
+		"""
+		self._needs_validation = False
+		if get_dir_mtime(self._path) == self._dir_mtime: return [], [], []
+		print("VERBOSE", f"Directory '{self._path}' was modified since the last snapshot, updating index")
+		return self.update()
+
+	def save_snapshot(self):
+		""" Write the index to its snapshot file if it changed since it was last written, has no effect if no snapshot file was set """
+		if self._snapshot_file is None or not self._dirty: return
+		with self._lock:
+			entries = list(self._entries.values())
+			self._dirty = False
+		try:
+			write_snapshot(self._snapshot_file, self._dir_mtime, entries)
+			print("VERBOSE", f"Saved library snapshot for '{self._path}'")
+		except OSError as e: print("ERROR", f"Writing library snapshot for '{self._path}':", e)
+
+	def rebuild(self):
+		"""
+		 Scan the full directory again, replacing all entries currently in this index
+		 Returns a tuple of lists containing the added, removed and updated entries compared to the previous scan
+		"""
+		print("VERBOSE", f"Building library index for '{self._path}'")
+		dir_mtime = get_dir_mtime(self._path)
+		entries = {}
+		try:
+			with os.scandir(self._path) as dir:
+				for entry in dir:
+					try:
+						if entry.is_file(): entries[entry.name] = create_entry(entry.name, entry.stat())
+					except OSError as e: print("WARNING", f"Cannot read '{entry.name}', it will not be indexed:", e)
+		except OSError as e: print("ERROR", f"Scanning '{self._path}':", e)
+
+		tokens = TokenIndex()
+		tokens.add_all(entries.values())
+
+		with self._lock:
+			previous = self._entries
+			self._entries, self._tokens = entries, tokens
+			self._dir_mtime = dir_mtime
+			self._loaded = self._dirty = True
+		print("VERBOSE", f"Library index for '{self._path}' contains {len(entries)} songs")
+
+		added = [entry for name, entry in entries.items() if name not in previous]
+		removed = [entry for name, entry in previous.items() if name not in entries]
+		updated = [entry for name, entry in entries.items() if name in previous and previous[name] != entry]
+		return added, removed, updated
+
+	def update(self, names=None):
+		"""
+		 Check the given filenames again and update their entries, or compare the full directory listing when no names are given
+		 Has no effect when the directory wasn't scanned yet
+		 Returns a tuple of lists containing the added, removed and updated entries
+		"""
+		added, removed, updated = [], [], []
+		if not self._loaded: return added, removed, updated
+
+		self._dir_mtime = get_dir_mtime(self._path)
+		if names is None:
+			try:
+				with os.scandir(self._path) as dir: current = {entry.name for entry in dir}
+			except OSError: current = set()
+			with self._lock: names = current.symmetric_difference(self._entries.keys())
+
+		for name in names:
+			try:
+				st = os.stat(os.path.join(self._path, name))
+				entry = create_entry(name, st) if stat.S_ISREG(st.st_mode) else None
+			except OSError: entry = None
+
+			with self._lock:
+				previous = self._entries.get(name)
+				if entry is None:
+					if previous is not None:
+						del self._entries[name]
+						self._tokens.remove(name, previous.keyword)
+						removed.append(previous)
+				else:
+					self._entries[name] = entry
+					if previous is None:
+						self._tokens.add(name, entry.keyword)
+						added.append(entry)
+					elif previous != entry: updated.append(entry)
+		if added or removed or updated: self._dirty = True
+		return added, removed, updated
+
+	def get(self, file):
+		""" Returns the entry for given filename or None if it isn't in this directory """
+		return self.ensure_loaded()._entries.get(file)
+
+	@property
+	def entries(self):
+		""" Returns a list of all entries in this directory """
+		self.ensure_loaded()
+		with self._lock: return list(self._entries.values())
+
+	def list_songs(self, keyword="", exact_search=False):
+		"""
+		 List all files in this directory matching the keyword, see 'MediaPlayer.list_songs' for details
+		 Files that contain the keyword as separate words are found by intersecting the words in the token index,
+		 when there are none the files containing the keyword anywhere are looked up using the word fragments
+		"""
+		self.ensure_loaded()
+		keyword = keyword.lower()
+		with self._lock:
+			if not keyword: return list(self._entries.keys())
+
+			words = keyword.split(" ")
+			candidates = self._tokens.find_words(words)
+			if exact_search:
+				res = [file for file in candidates if self._entries[file].keyword == keyword]
+				if res: return self._tokens.sort(res)[:1]
+
+			padded_keyword = " " + keyword + " "
+			res = [file for file in candidates if padded_keyword in " " + self._entries[file].keyword + " "]
+			if len(res) > 0: return self._tokens.sort(res)
+
+			candidates = self._tokens.find_fragment(words)
+			return self._tokens.sort([file for file in candidates if keyword in self._entries[file].keyword])
+
+	def find_songs(self, names):
+		"""
+		 Returns the file for every given display name in a list with the same order, or None for names that have no file with an exactly matching name
+		 All names are matched in a single pass over the entries, when multiple files match a name the first one added is used
+		"""
+		self.ensure_loaded()
+		keywords = [name.replace(" - ", " ").lower() for name in names]
+		matches = dict.fromkeys(keywords)
+		with self._lock:
+			for file, entry in self._entries.items():
+				if entry.keyword in matches:
+					if matches[entry.keyword] is None: matches[entry.keyword] = [file]
+					else: matches[entry.keyword].append(file)
+			for keyword, files in matches.items():
+				if files is not None: matches[keyword] = self._tokens.sort(files)[0]
+		return [matches[keyword] for keyword in keywords]
+
+	def search(self, keyword, limit, min_score):
+		""" Typo tolerant search for files matching the keyword, see 'TokenIndex.find_similar' for details """
+		self.ensure_loaded()
+		with self._lock: return self._tokens.find_similar(keyword.lower().replace(" - ", " ").split(" "), limit, min_score)
+
+	def __contains__(self, file): return file in self.ensure_loaded()._entries
+	def __len__(self): return len(self.ensure_loaded()._entries)
+	def __str__(self): return f"DirectoryIndex[path={self._path}, loaded={self._loaded}, song_count={len(self._entries)}]"
+
+class SongLibrary:
+	"""
+	 Collection of directory indexes, one for every directory that songs were requested from
+	 Indexes are created on first use and kept in memory afterwards, when the watcher is started they are kept up to date with the directory contents
+	 When a cache directory is given, every index is saved as a snapshot so it can be loaded without scanning the directory on the next start
+	"""
+	max_search_threads = 4
+	min_search_score = 0.5
+
+	def __init__(self, cache_dir=None):
+		self._cache_dir = cache_dir
+		self._indexes = {}
+		self._lock = threading.Lock()
+		self._listeners = []
+		self._watcher = None
+		self._executor = None
+
+	def add_listener(self, cb):
+		""" Register a callback that is called with a 'LibraryUpdate' every time the contents of an indexed directory change
+		 	Note: the callback is called from the watcher thread """
+		if not callable(cb): raise TypeError("Listener must be callable")
+		if cb not in self._listeners: self._listeners.append(cb)
+
+	def remove_listener(self, cb):
+		""" Remove a callback previously registered with 'add_listener', has no effect if it was never added """
+		try: self._listeners.remove(cb)
+		except ValueError: pass
+
+	def _call_listeners(self, update):
+		for cb in self._listeners:
+			try: cb(update)
+			except Exception as e: print("ERROR", "Calling library listener:", e)
+
+	def start_watcher(self):
+		""" Start watching all indexed directories (and those indexed later) for changes """
+		if self._watcher is None or not self._watcher.running:
+			self._watcher = LibraryWatcher(self._on_directory_changed)
+			with self._lock: indexes = list(self._indexes.values())
+			for index in indexes: self._watcher.watch(index.path)
+
+	def stop_watcher(self):
+		""" Stop watching the indexed directories, the indexes will no longer be updated automatically """
+		if self._watcher is not None:
+			self._watcher.stop()
+			self._watcher = None
+
+	def _notify_changes(self, index, changes):
+		added, removed, updated = changes
+		if added or removed or updated:
+			print("VERBOSE", f"Library '{index.path}' updated: {len(added)} added, {len(removed)} removed, {len(updated)} updated")
+			self._call_listeners(LibraryUpdate(index.path, added, removed, updated))
+
+	def _on_directory_changed(self, path, names):
+		with self._lock: index = self._indexes.get(path_key(path))
+		if index is not None: self._notify_changes(index, index.update(names))
+
+	def get_index(self, path):
+		""" Returns the (loaded) index for given directory or None if the path is not a valid directory """
+		if not path or not os.path.isdir(path): return None
+
+		key = path_key(path)
+		with self._lock:
+			index = self._indexes.get(key)
+			if index is None:
+				self._indexes[key] = index = DirectoryIndex(path, self._get_snapshot_file(key))
+				if self._watcher is not None: self._watcher.watch(path)
+
+		index.ensure_loaded()
+		if index.needs_validation: self._get_executor().submit(self._validate_index, index)
+		return index
+
+	def _get_snapshot_file(self, key):
+		if self._cache_dir is None: return None
+		if not os.path.isdir(self._cache_dir): os.makedirs(self._cache_dir)
+		return os.path.join(self._cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".idx")
+
+	def _validate_index(self, index):
+		if index.needs_validation: self._notify_changes(index, index.validate())
+
+	def _get_executor(self):
+		with self._lock:
+			if self._executor is None: self._executor = ThreadPoolExecutor(max_workers=self.max_search_threads, thread_name_prefix="LibrarySearch")
+			return self._executor
+
+	def save_snapshots(self):
+		""" Save the snapshot of every index that changed since it was last saved """
+		for index in self.indexes: index.save_snapshot()
+
+	@property
+	def indexes(self):
+		""" Returns a list of all directory indexes in the library """
+		with self._lock: return list(self._indexes.values())
+
+	def load(self, paths):
+		""" Make sure the index for all given paths is available """
+		for path in paths: self.get_index(path)
+
+	def refresh(self, path=None):
+		""" Rescan given directory, or all directories in the library when no path is given """
+		if path is not None:
+			index = self.get_index(path)
+			if index is not None: self._notify_changes(index, index.rebuild())
+		else:
+			with self._lock: indexes = list(self._indexes.values())
+			for index in indexes: self._notify_changes(index, index.rebuild())
+		self.save_snapshots()
+
+	def close(self):
+		""" Stop the watcher, save all snapshots and remove all indexes from memory """
+		self.stop_watcher()
+		self.save_snapshots()
+		if self._executor is not None:
+			self._executor.shutdown(wait=False)
+			self._executor = None
+		with self._lock: self._indexes.clear()
+
+	def _search_index(self, path, search):
+		index = self.get_index(path)
+		return search(index) if index is not None else None
+
+	def find_first(self, paths, search):
+		"""
+		 Call 'search' with the index of every given path, all paths are searched at the same time on a thread pool
+		 Returns a tuple (index, result) for the first path in the list where the search returned a non-empty result or (-1, None) if there is none
+		"""
+		if len(paths) == 1:
+			res = self._search_index(paths[0], search)
+			return (0, res) if res else (-1, None)
+
+		executor = self._get_executor()
+		futures = [executor.submit(self._search_index, path, search) for path in paths]
+		try:
+			for i, future in enumerate(futures):
+				res = future.result()
+				if res: return i, res
+		finally:
+			for future in futures: future.cancel()
+		return -1, None
+
+	def list_songs(self, path, keyword="", exact_search=False):
+		""" List all songs in given path matching the keyword, returns an empty list if the path is invalid """
+		index = self.get_index(path)
+		return index.list_songs(keyword, exact_search) if index is not None else []
+
+	def find_songs(self, path, names):
+		""" Returns the file for every given display name in given path, see 'DirectoryIndex.find_songs' for details """
+		index = self.get_index(path)
+		return index.find_songs(names) if index is not None else [None] * len(names)
+
+	def search(self, path, keyword, limit=15, min_score=None):
+		""" Typo tolerant search for songs in given path, returns a list of tuples (file, score) with the best matches first """
+		index = self.get_index(path)
+		return index.search(keyword, limit, min_score if min_score is not None else self.min_search_score) if index is not None else []
+
+	def __str__(self): return f"SongLibrary[directories={len(self._indexes)}]"
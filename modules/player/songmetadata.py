@@ -0,0 +1,157 @@
+import os, queue, sqlite3, threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from core import mediaanalysis
+
+SongMetadata = namedtuple("SongMetadata", ["artist", "title", "album", "duration", "bitrate", "gain"], defaults=(None,))
+
+def split_displayname(display_name):
+	""" Guess the artist and title from a song name in the format 'artist - title', returns a tuple (artist, title) where artist is None if it cannot be determined """
+	song = display_name.split(" - ", maxsplit=1)
+	return (song[0], song[1]) if len(song) > 1 else (None, song[0])
+
+class MetadataStore:
+	"""
+	 Cache for the tags and duration of songs, stored in a SQLite database
+	 Every file is only read once, it is read again only when its modification time or size changes
+	 Files are read by a pool of worker processes on a background thread, lookups are answered from memory
+	 After the tags are read the loudness of every song is measured (with lower priority) to calculate the gain needed to reach the reference loudness
+	"""
+	batch_size = 64
+	loudness_batch_size = 8
+	max_processes = 4
+	reference_loudness = -18
+
+	def __init__(self, file):
+		self._file = file
+		self._lock = threading.Lock()
+		self._connection = None
+		self._cache = {}
+		self._listeners = []
+		self._queue = queue.Queue()
+		self._loudness_queue = deque()
+		self._thread = None
+		self._available = mediaanalysis.is_available()
+		if not self._available: print("INFO", "'mutagen' is not installed, song metadata will be guessed from the filename")
+		self._loudness_available = self._available and mediaanalysis.is_loudness_available()
+		if self._available and not self._loudness_available: print("INFO", "'numpy' or 'ffmpeg' is not installed, song volume will not be normalized")
+
+	def _open(self):
+		if self._connection is None:
+			self._connection = sqlite3.connect(self._file, check_same_thread=False)
+			self._connection.execute("CREATE TABLE IF NOT EXISTS metadata (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, artist TEXT, title TEXT, album TEXT, duration REAL, bitrate INTEGER, gain REAL)")
+			if "gain" not in [column[1] for column in self._connection.execute("PRAGMA table_info(metadata)")]:
+				with self._connection: self._connection.execute("ALTER TABLE metadata ADD COLUMN gain REAL")
+			for path, mtime, size, *data in self._connection.execute("SELECT path, mtime, size, artist, title, album, duration, bitrate, gain FROM metadata"):
+				self._cache[path] = (mtime, size, SongMetadata(*data))
+			print("VERBOSE", f"Loaded metadata for {len(self._cache)} songs")
+
+	def add_listener(self, cb):
+		""" Register a callback that is called (from the analysis thread) with the list of file paths every time new metadata is stored """
+		if not callable(cb): raise TypeError("Listener must be callable")
+		if cb not in self._listeners: self._listeners.append(cb)
+
+	def get(self, filepath, mtime, size):
+		""" Returns the stored metadata for given file if it was read from a file with the same modification time and size, otherwise None """
+		with self._lock:
+			if self._connection is None: self._open()
+			data = self._cache.get(filepath)
+		if data is not None and data[0] == mtime and data[1] == size: return data[2]
+		return None
+
+	def get_gain(self, filepath):
+		""" Returns the gain (in dB) that should be applied to given file to reach the reference loudness, or 0 if it isn't measured (yet) """
+		data = self._cache.get(filepath)
+		return data[2].gain if data is not None and data[2].gain is not None else 0
+
+	def analyze(self, path, entries):
+		""" Read the metadata for all given library entries in given path that aren't stored yet, this happens in the background """
+		if not self._available: return
+		with self._lock:
+			if self._connection is None: self._open()
+			missing, unmeasured = [], []
+			for entry in entries:
+				filepath = os.path.join(path, entry.file)
+				data = self._cache.get(filepath)
+				if data is None or data[0] != entry.mtime or data[1] != entry.size: missing.append((filepath, entry.mtime, entry.size))
+				elif self._loudness_available and data[2].gain is None: unmeasured.append((filepath, entry.mtime, entry.size))
+
+		if missing: print("VERBOSE", f"Reading metadata for {len(missing)} songs in '{path}'")
+		if unmeasured: print("VERBOSE", f"Measuring loudness for {len(unmeasured)} songs in '{path}'")
+		if missing or unmeasured:
+			self._queue.put((missing, unmeasured))
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(name="MetadataAnalyzer", target=self._run, daemon=True)
+				self._thread.start()
+
+	def _run(self):
+		with ProcessPoolExecutor(max_workers=self.max_processes) as executor:
+			while True:
+				# tags are always read first, loudness is only measured while there are no tags left to read
+				try: work = self._queue.get(timeout=5 if not self._loudness_queue else 0)
+				except queue.Empty:
+					if not self._loudness_queue: break
+					self._measure(executor)
+					continue
+				if work is None: break
+
+				files, unmeasured = work
+				self._loudness_queue.extend(unmeasured)
+				for start in range(0, len(files), self.batch_size):
+					batch = files[start:start + self.batch_size]
+					try: results = list(executor.map(mediaanalysis.read_tags, [file[0] for file in batch], chunksize=8))
+					except Exception as e:
+						print("ERROR", "Reading song metadata:", e)
+						continue
+					self._store(batch, results)
+					if self._loudness_available: self._loudness_queue.extend(file for file, data in zip(batch, results) if data is not None)
+
+	def _measure(self, executor):
+		batch = [self._loudness_queue.popleft() for _ in range(min(self.loudness_batch_size, len(self._loudness_queue)))]
+		try: results = list(executor.map(mediaanalysis.measure_loudness, [file[0] for file in batch]))
+		except Exception as e:
+			print("ERROR", "Measuring song loudness:", e)
+			return
+
+		rows = []
+		with self._lock:
+			if self._connection is None: return
+			for (filepath, mtime, size), loudness in zip(batch, results):
+				data = self._cache.get(filepath)
+				if data is None or data[0] != mtime or data[1] != size: continue
+				# songs that cannot be measured get a gain of 0 so they aren't measured again
+				gain = round(self.reference_loudness - loudness, 2) if loudness is not None else 0.0
+				self._cache[filepath] = (mtime, size, data[2]._replace(gain=gain))
+				rows.append((gain, filepath, mtime, size))
+			try:
+				with self._connection: self._connection.executemany("UPDATE metadata SET gain=? WHERE path=? AND mtime=? AND size=?", rows)
+			except sqlite3.Error as e: print("ERROR", "Writing song loudness:", e)
+		self._call_listeners([row[1] for row in rows])
+
+	def _store(self, files, results):
+		rows = []
+		with self._lock:
+			if self._connection is None: return
+			for (filepath, mtime, size), data in zip(files, results):
+				metadata = SongMetadata(*data) if data is not None else SongMetadata(None, None, None, None, None, 0.0)
+				self._cache[filepath] = (mtime, size, metadata)
+				rows.append((filepath, mtime, size, *metadata))
+			try:
+				with self._connection: self._connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			except sqlite3.Error as e: print("ERROR", "Writing song metadata:", e)
+		self._call_listeners([file[0] for file in files])
+
+	def _call_listeners(self, paths):
+		for cb in self._listeners:
+			try: cb(paths)
+			except Exception as e: print("ERROR", "Calling metadata listener:", e)
+
+	def close(self):
+		""" Stop reading metadata and close the database """
+		self._queue.put(None)
+		if self._thread is not None: self._thread.join(1)
+		with self._lock:
+			if self._connection is not None:
+				self._connection.close()
+				self._connection = None
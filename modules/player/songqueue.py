@@ -1,89 +1,228 @@
-from collections import deque
+import itertools, threading
 from core import modules
 module = modules.Module(__package__)
 
 from ui.qt import pyelement
+from .songcatalog import song_catalog
 
 class SongQueue:
+    """
+     Queue of songs to play next, songs are stored by their file id in the song catalog
+     Every song added gets an entry with a stable id, entries are kept in a linked list indexed by their id so they can be removed and moved without searching the queue
+     Operations that change multiple songs fire a single update event
+    """
     def __init__(self):
-        self._queue = deque()
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._songs = {}
+        self._prev = {}
+        self._next = {}
+        self._head = self._tail = None
+        self._song_entries = {}
         self._on_update = None
 
     def OnUpdate(self, cb):
-        """ Fired when the queue changes """
+        """ Fired when the queue changes, use 'entries' to get the updated queue """
         self._on_update = cb
 
     def _call_update(self):
         if callable(self._on_update):
-            try: self._on_update(iter(self._queue))
+            try: self._on_update()
             except Exception as e: print("ERROR", "Calling update event:", e)
 
+    # linked list operations, the lock must be held when calling these
+    def _link(self, entry, before):
+        """ Insert an entry in front of the entry 'before', or at the end if it is None """
+        prev = self._prev[before] if before is not None else self._tail
+        self._prev[entry], self._next[entry] = prev, before
+        if prev is not None: self._next[prev] = entry
+        else: self._head = entry
+        if before is not None: self._prev[before] = entry
+        else: self._tail = entry
+
+    def _unlink(self, entry):
+        prev, next = self._prev[entry], self._next[entry]
+        if prev is not None: self._next[prev] = next
+        else: self._head = next
+        if next is not None: self._prev[next] = prev
+        else: self._tail = prev
+
+    def _insert(self, song, before=None):
+        entry = next(self._ids)
+        self._songs[entry] = song
+        self._song_entries.setdefault(song, {})[entry] = None
+        self._link(entry, before)
+        return entry
+
+    def _delete(self, entry):
+        self._unlink(entry)
+        del self._prev[entry], self._next[entry]
+        song = self._songs.pop(entry)
+        entries = self._song_entries[song]
+        del entries[entry]
+        if not entries: del self._song_entries[song]
+        return song
+
+    def _entry_at(self, index):
+        if index < 0: index += len(self._songs)
+        if not 0 <= index < len(self._songs): raise IndexError("Queue index out of range")
+        if index < len(self._songs) // 2:
+            entry = self._head
+            for _ in range(index): entry = self._next[entry]
+        else:
+            entry = self._tail
+            for _ in range(len(self._songs) - 1 - index): entry = self._prev[entry]
+        return entry
+
+    def _index_of(self, entry):
+        index = 0
+        while self._prev[entry] is not None:
+            entry = self._prev[entry]
+            index += 1
+        return index
+
+    def _first_entry(self, entries):
+        """ Returns the entry closest to the front of the queue out of the given entries of a song """
+        if len(entries) == 1: return next(iter(entries))
+        entry = self._head
+        while entry not in entries: entry = self._next[entry]
+        return entry
+
     def add(self, song):
-        """ Add a new song to the end of the queue """
-        self._queue.append(song)
+        """ Add a new song to the end of the queue, returns the id of its entry """
+        with self._lock: entry = self._insert(song)
         self._call_update()
+        return entry
+
+    def extend(self, songs):
+        """ Add all given songs to the end of the queue, returns a list with the ids of their entries """
+        with self._lock: entries = [self._insert(song) for song in songs]
+        if entries: self._call_update()
+        return entries
 
     def clear(self):
         """ Remove all songs from the queue """
-        self._queue.clear()
+        with self._lock:
+            self._songs.clear()
+            self._prev.clear()
+            self._next.clear()
+            self._song_entries.clear()
+            self._head = self._tail = None
         self._call_update()
 
     def remove(self, song):
-        """ Remove a specific song from the queue, has no effect if the song isn't in the queue """
-        try: self._queue.remove(song)
-        except KeyError: pass
-        else: self._call_update()
+        """ Remove a specific song from the queue, when the song is queued more than once the first one is removed
+            Has no effect if the song isn't in the queue """
+        with self._lock:
+            entries = self._song_entries.get(song)
+            if not entries: return
+            self._delete(self._first_entry(entries))
+        self._call_update()
+
+    def remove_entry(self, entry):
+        """ Remove the entry with given id from the queue, has no effect if it isn't in the queue """
+        self.remove_many((entry,))
+
+    def remove_many(self, entries):
+        """ Remove all entries with given ids from the queue, entries that aren't in the queue are ignored """
+        with self._lock: removed = [self._delete(entry) for entry in entries if entry in self._songs]
+        if removed: self._call_update()
+
+    def reorder(self, entries):
+        """ Move the entries with given ids to the front of the queue in the given order, all other entries keep their order after them """
+        with self._lock:
+            before = self._head
+            for entry in entries:
+                if entry not in self._songs: continue
+                if entry == before: before = self._next[entry]
+                else:
+                    self._unlink(entry)
+                    self._link(entry, before)
+        self._call_update()
 
     def get_next(self):
         """ Returns the next song and removes it from the queue or None if the queue is empty """
-        try: item = self._queue.popleft()
-        except IndexError: item = None
-        else: self._call_update()
+        with self._lock: item = self._delete(self._head) if self._head is not None else None
+        if item is not None: self._call_update()
         return item
 
     def peek_next(self):
         """ Returns the next song without removing it from the list or None if the queue is empty """
-        try: return self._queue[0]
-        except IndexError: return None
-
-    def _move(self, song, index, n):
-        if index is None:
-            try: index = self._queue.index(song)
-            except ValueError: return 0
-        elif song is None: song = self._queue[index]
-        else: raise ValueError("Must specify song or index")
-
-        del self._queue[index]
-        index = min(max(index - n, 0), len(self._queue))
-        self._queue.insert(index, song)
+        with self._lock: return self._songs[self._head] if self._head is not None else None
+
+    def get_song(self, entry):
+        """ Returns the song of the entry with given id """
+        return self._songs[entry]
+
+    def entries(self):
+        """ Returns a list of tuples (entry id, song) for every song in the queue, in order """
+        with self._lock:
+            res = []
+            entry = self._head
+            while entry is not None:
+                res.append((entry, self._songs[entry]))
+                entry = self._next[entry]
+            return res
+
+    def _move(self, song, index, entry, n):
+        with self._lock:
+            if entry is not None:
+                if entry not in self._songs: return 0
+            elif index is not None:
+                if song is not None: raise ValueError("Must specify song or index")
+                entry = self._entry_at(index)
+            elif song in self._song_entries: entry = self._first_entry(self._song_entries[song])
+            else: return 0
+
+            # walk from the current place, the entry itself is skipped so it can stay linked until it is moved
+            before = self._next[entry]
+            if n > 0:
+                for _ in range(n):
+                    prev = self._prev[before] if before is not None else self._tail
+                    if prev == entry: prev = self._prev[entry]
+                    if prev is None: break
+                    before = prev
+            else:
+                for _ in range(-n):
+                    if before is None: break
+                    before = self._next[before]
+
+            if before != self._next[entry]:
+                self._unlink(entry)
+                self._link(entry, before)
+            index = self._index_of(entry)
         self._call_update()
         return index
 
-    def move_up(self, song=None, index=None, n=1):
+    def move_up(self, song=None, index=None, n=1, entry=None):
         """
-         Moves the specified song or index forward n spaces (or until it reaches the front), has no effect if the song isn't in the queue
+         Moves the specified song, index or entry id forward n spaces (or until it reaches the front), has no effect if the song isn't in the queue
          Returns the new index of the song or 0 if the song wasn't found
         """
-        return self._move(song, index, n)
+        return self._move(song, index, entry, n)
 
-    def move_down(self, song=None, index=None, n=1):
+    def move_down(self, song=None, index=None, n=1, entry=None):
         """
-         Moves the specified song or index backward n spaces (or until it reaches the back), has no effect if the song isn't in the queue
+         Moves the specified song, index or entry id backward n spaces (or until it reaches the back), has no effect if the song isn't in the queue
          Returns the new index of the song or 0 if the song wasn't found
         """
-        return self._move(song, index, -n)
+        return self._move(song, index, entry, -n)
 
-    def __contains__(self, item): return self._queue.__contains__(item)
-    def __iter__(self): return self._queue.__iter__()
-    def __len__(self): return self._queue.__len__()
-    def __str__(self): return f"SongQueue[song_count={len(self._queue)}]"
+    def __contains__(self, item): return item in self._song_entries
+    def __iter__(self): return iter([song for entry, song in self.entries()])
+    def __len__(self): return len(self._songs)
+    def __str__(self): return f"SongQueue[song_count={len(self._songs)}]"
 
-    def __getitem__(self, index): return self._queue.__getitem__(index)
+    def __getitem__(self, index):
+        with self._lock: return self._songs[self._entry_at(index)]
     def __setitem__(self, index, value):
-        self._queue.__setitem__(index, value)
+        with self._lock:
+            entry = self._entry_at(index)
+            self._insert(value, before=entry)
+            self._delete(entry)
         self._call_update()
     def __delitem__(self, index):
-        self._queue.__delitem__(index)
+        with self._lock: self._delete(self._entry_at(index))
         self._call_update()
 
 song_queue = SongQueue()
@@ -96,39 +235,63 @@ class SongQueueViewer(pyelement.PyFrame):
 
         queue_update = "queue_update"
         self.window.add_task(queue_update, self._on_queue_update)
-        self._queue.OnUpdate(lambda q: self.window.schedule_task(task_id=queue_update, items=q))
-        self._on_queue_update(self._queue)
+        self._queue.OnUpdate(lambda: self.window.schedule_task(task_id=queue_update))
+        self._on_queue_update()
         @self.events.EventDestroy
         def _on_close(): self._queue.OnUpdate(None)
 
     def create_widgets(self):
         self.add_element("lbl", element_class=pyelement.PyTextLabel).text = "Items in queue:"
         items: pyelement.PyItemlist = self.add_element("items", element_class=pyelement.PyItemlist, row=1, columnspan=2)
+        items.set_items([], lambda item: song_catalog.get_file_name(item[1]))
         btn = self.add_element("queue_up", element_class=pyelement.PyButton, row=2)
         btn.text = "Move up"
         @btn.events.EventInteract
         def _move_item_up():
-            if len(self._queue) > 0: items.selected_index = self._queue.move_up(index=items.selected_index)
+            entry = self._selected_entry()
+            if entry is not None:
+                self._queue.move_up(entry=entry)
+                self._on_queue_update()
 
         btn2: pyelement.PyButton = self.add_element("queue_down", element_class=pyelement.PyButton, row=2, column=1)
         btn2.text = "Move down"
         @btn2.events.EventInteract
         def _move_item_down():
-            if len(self._queue) > 0: items.selected_index = self._queue.move_down(index=items.selected_index)
+            entry = self._selected_entry()
+            if entry is not None:
+                self._queue.move_down(entry=entry)
+                self._on_queue_update()
 
         btn3 = self.add_element("queue_del", element_class=pyelement.PyButton, row=3)
         btn3.text = "Delete"
         @btn3.events.EventInteract
         def _delete_item():
-            if len(self._queue) > 0: del self._queue[items.selected_index]
+            entry = self._selected_entry()
+            if entry is not None:
+                self._queue.remove_entry(entry)
+                self._on_queue_update()
 
         btn4 = self.add_element("queue_clear", element_class=pyelement.PyButton, row=3, column=1)
         btn4.text = "Clear"
         @btn4.events.EventInteract
         def _clear_queue(): self._queue.clear()
 
-    def _on_queue_update(self, items):
-        queue = self["items"]
-        selection = queue.selected_index
-        queue.itemlist = [module.get_displayname(item[1]) for item in items]
-        queue.selected_index = selection
\ No newline at end of file
+    def _selected_entry(self):
+        items = self["items"]
+        index = items.selected_index
+        return items.model.items[index][0] if 0 <= index < len(items.model.items) else None
+
+    def _on_queue_update(self):
+        """ Apply the changes to the queue to the list, only the rows that changed are updated so the selection stays on the same song """
+        model = self["items"].model
+        entries = self._queue.entries()
+        keep = set(entries)
+        if keep.isdisjoint(model.items): return model.set_items(entries)
+
+        for row in range(len(model.items) - 1, -1, -1):
+            if model.items[row] not in keep: model.remove_item(row)
+        for row, entry in enumerate(entries):
+            items = model.items
+            if row < len(items) and items[row] == entry: continue
+            try: model.move_item(items.index(entry, row), row)
+            except ValueError: model.insert_item(row, entry)
\ No newline at end of file
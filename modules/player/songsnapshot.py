@@ -0,0 +1,49 @@
+import mmap, os, struct
+
+# Snapshot layout (little endian):
+#   header: magic, format version, directory modification time (ns), number of songs
+#   records: one fixed width record per song with its size, modification and creation time
+#   string table: utf-8 encoded file name and normalized name of every song, all separated by a null character
+MAGIC = b"PYLS"
+VERSION = 1
+HEADER = struct.Struct("<4sHqI")
+RECORD = struct.Struct("<Qdd")
+
+def write_snapshot(file, dir_mtime, entries):
+	""" Write the given library entries to file, the file is replaced only once it was written completely """
+	records = bytearray()
+	strings = []
+	for entry in entries:
+		records += RECORD.pack(entry.size, entry.mtime, entry.ctime)
+		strings.append(entry.file)
+		strings.append(entry.keyword)
+
+	tmp_file = file + ".tmp"
+	with open(tmp_file, "wb") as out:
+		out.write(HEADER.pack(MAGIC, VERSION, dir_mtime, len(entries)))
+		out.write(records)
+		out.write("\0".join(strings).encode())
+	os.replace(tmp_file, file)
+
+def read_snapshot(file, create_entry):
+	"""
+	 Read a snapshot written by 'write_snapshot', every song is passed to 'create_entry' as (file, keyword, size, mtime, ctime)
+	 Returns a tuple (directory modification time, list of created entries) or None if the file doesn't exist or is invalid
+	"""
+	try:
+		with open(file, "rb") as snapshot, mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			magic, version, dir_mtime, count = HEADER.unpack_from(data, 0)
+			if magic != MAGIC or version != VERSION:
+				print("INFO", f"Ignoring snapshot '{file}' with unsupported format")
+				return None
+
+			string_start = HEADER.size + count * RECORD.size
+			strings = data[string_start:].decode().split("\0") if count > 0 else []
+			if len(strings) != 2 * count: raise ValueError("song count doesn't match number of names")
+
+			records = RECORD.iter_unpack(data[HEADER.size:string_start])
+			return dir_mtime, [create_entry(name, keyword, *record) for name, keyword, record in zip(strings[0::2], strings[1::2], records)]
+	except FileNotFoundError: return None
+	except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+		print("WARNING", f"Cannot read snapshot '{file}':", e)
+		return None
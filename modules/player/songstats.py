@@ -0,0 +1,138 @@
+from datetime import date
+import bisect, calendar, heapq, os, threading
+
+from . import song_tracker
+from .songcatalog import PlayCounter, song_catalog
+from .songmetadata import split_displayname
+
+_month_names = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+
+def get_month_date(file):
+	""" Returns the first day of the month the given month file belongs to, or None if it isn't named after a month """
+	for name, month in _month_names.items():
+		if file.startswith(name):
+			try: return date(int(file[len(name):]), month, 1)
+			except ValueError: return None
+	return None
+
+class _PlayData:
+	""" Play counts of all songs together with the indexes used to answer the queries on them without going through all songs """
+	def __init__(self):
+		# song id -> tuple (sorted list of days played, running total of plays on those days)
+		self.songs = {}
+		# lowercase artist -> list of ids of the songs from this artist that were played
+		self.artists = {}
+		# sorted list of tuples (last day played, song id), only built once all plays are loaded
+		self.last_played = None
+
+	def add(self, song_id, day, count):
+		data = self.songs.get(song_id)
+		if data is None:
+			self.songs[song_id] = ([day], [count])
+			artist = split_displayname(song_catalog.get_song_name(song_id))[0]
+			if artist is not None: self.artists.setdefault(artist.lower(), []).append(song_id)
+			if self.last_played is not None: bisect.insort(self.last_played, (day, song_id))
+			return
+
+		days, totals = data
+		last_day = days[-1]
+		if day == last_day: totals[-1] += count
+		elif day > last_day:
+			days.append(day)
+			totals.append(totals[-1] + count)
+			if self.last_played is not None:
+				del self.last_played[bisect.bisect_left(self.last_played, (last_day, song_id))]
+				bisect.insort(self.last_played, (day, song_id))
+		else:
+			i = bisect.bisect_left(days, day)
+			if days[i] != day:
+				days.insert(i, day)
+				totals.insert(i, totals[i - 1] if i > 0 else 0)
+			for j in range(i, len(totals)): totals[j] += count
+
+	def build_last_played(self):
+		self.last_played = sorted((data[0][-1], song_id) for song_id, data in self.songs.items())
+
+class PlayStatistics:
+	"""
+	 Play counts of every song per day, built from the play events logged by the song tracker
+	 For every song the days it was played on are kept sorted together with the running total of its plays,
+	 this way the number of plays in any time range is found with two binary searches
+	 Plays from before events were logged are only known per month and are counted on the first day of their month
+	 Songs are stored by their id in the song catalog, names are only resolved for the results
+	 The songs of every artist and the order in which songs were last played are updated with every play, so these are never searched for
+	"""
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._songs = None
+		song_tracker.listeners.append(self._on_play)
+
+	def _get_songs(self):
+		with self._lock:
+			if self._songs is None: self._songs = self._load()
+			return self._songs
+
+	def _load(self):
+		song_tracker.flush()
+		data = _PlayData()
+		months = []
+		for file in os.listdir("statistics"):
+			month = get_month_date(file) if song_tracker.is_month_file(file) else None
+			if month is not None: months.append((month, file))
+		months.sort()
+
+		for month, file in months:
+			events = [(timestamp, count, song_catalog.get_song_id(song)) for timestamp, count, song in song_tracker.read_events(file)]
+			logged = PlayCounter((song_id, count) for timestamp, count, song_id in events)
+			for song_id, count in song_tracker.load_file(file).items():
+				if count > logged[song_id]: data.add(song_id, month.toordinal(), count - logged[song_id])
+			for timestamp, count, song_id in events: data.add(song_id, date.fromtimestamp(timestamp).toordinal(), count)
+		data.build_last_played()
+		print("VERBOSE", f"Loaded play statistics for {len(data.songs)} songs from {len(months)} months")
+		return data
+
+	def _on_play(self, song, count):
+		with self._lock:
+			if self._songs is not None: self._songs.add(song_catalog.get_song_id(song), date.today().toordinal(), count)
+
+	def reload(self):
+		""" Read all play events again the next time statistics are requested """
+		with self._lock: self._songs = None
+
+	@staticmethod
+	def _count(data, start, end):
+		days, totals = data
+		i, j = bisect.bisect_left(days, start), bisect.bisect_right(days, end)
+		return (totals[j - 1] if j > 0 else 0) - (totals[i - 1] if i > 0 else 0)
+
+	def get_count(self, song, start, end):
+		""" Returns the number of times given song was played between the given dates (inclusive) """
+		data = self._get_songs().songs.get(song_catalog.find_song_id(song))
+		return self._count(data, start.toordinal(), end.toordinal()) if data is not None else 0
+
+	def get_top(self, start, end, n):
+		""" Returns the 'n' most played songs between the given dates (inclusive) as a list of tuples (song, count) """
+		start, end = start.toordinal(), end.toordinal()
+		counts = ((self._count(data, start, end), song_id) for song_id, data in self._get_songs().songs.items() if data[0][-1] >= start and data[0][0] <= end)
+		return [(song_catalog.get_song_name(song_id), count) for count, song_id in heapq.nlargest(n, counts) if count > 0]
+
+	def get_artist_weeks(self, artist, start, weeks):
+		""" Returns the number of plays of songs from given artist for every week starting from given date as a list """
+		artist = artist.lower()
+		start = start.toordinal()
+		end = start + 7 * weeks - 1
+		res = [0] * weeks
+		data = self._get_songs()
+		for song_id in data.artists.get(artist, ()):
+			days, totals = data.songs[song_id]
+			for i in range(bisect.bisect_left(days, start), bisect.bisect_right(days, end)):
+				res[(days[i] - start) // 7] += totals[i] - (totals[i - 1] if i > 0 else 0)
+		return res
+
+	def get_unplayed(self, since):
+		""" Returns all songs that were played before but not since given date as a list of tuples (song, date last played), sorted from least recently played """
+		last_played = self._get_songs().last_played
+		end = bisect.bisect_left(last_played, (since.toordinal(),))
+		return [(song_catalog.get_song_name(song_id), date.fromordinal(day)) for day, song_id in last_played[:end]]
+
+play_statistics = PlayStatistics()
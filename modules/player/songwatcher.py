@@ -0,0 +1,163 @@
+import os, select, struct, sys, threading, time
+
+class _InotifyBackend:
+	""" Watches directories using the inotify api, only available on Linux """
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_FROM = 0x40
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	IN_DELETE_SELF = 0x400
+	IN_MOVE_SELF = 0x800
+	IN_Q_OVERFLOW = 0x4000
+	IN_IGNORED = 0x8000
+	IN_ONLYDIR = 0x1000000
+	IN_ISDIR = 0x40000000
+	watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+	event_header = struct.Struct("iIII")
+
+	def __init__(self):
+		import ctypes, ctypes.util
+		self._ctypes = ctypes
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self._fd < 0: raise OSError(ctypes.get_errno(), "Cannot initialize inotify")
+		self._watches = {}
+
+	def add(self, path):
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.watch_mask)
+		if wd < 0: raise OSError(self._ctypes.get_errno(), f"Cannot watch '{path}'")
+		self._watches[wd] = path
+
+	def remove(self, path):
+		for wd, watched in list(self._watches.items()):
+			if watched == path:
+				self._libc.inotify_rm_watch(self._fd, wd)
+				self._watches.pop(wd, None)
+
+	def wait(self, timeout):
+		ready, _, _ = select.select([self._fd], [], [], timeout)
+		if not ready: return []
+		try: data = os.read(self._fd, 65536)
+		except BlockingIOError: return []
+
+		changes = []
+		offset = 0
+		while offset + self.event_header.size <= len(data):
+			wd, mask, _, length = self.event_header.unpack_from(data, offset)
+			offset += self.event_header.size
+			name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+			offset += length
+
+			if mask & self.IN_Q_OVERFLOW:
+				changes.extend((path, None) for path in self._watches.values())
+				continue
+
+			path = self._watches.get(wd)
+			if path is None or mask & self.IN_ISDIR: continue
+			if mask & self.IN_IGNORED: self._watches.pop(wd, None)
+			elif mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF): changes.append((path, None))
+			elif name: changes.append((path, name))
+		return changes
+
+	def close(self):
+		os.close(self._fd)
+		self._watches.clear()
+
+class _PollingBackend:
+	""" Watches directories by checking their modification time every few seconds """
+	def __init__(self, interval):
+		self._interval = interval
+		self._paths = {}
+		self._next_poll = time.monotonic() + interval
+
+	@staticmethod
+	def _get_mtime(path):
+		try: return os.stat(path).st_mtime_ns
+		except OSError: return None
+
+	def add(self, path): self._paths[path] = self._get_mtime(path)
+	def remove(self, path): self._paths.pop(path, None)
+
+	def wait(self, timeout):
+		remaining = self._next_poll - time.monotonic()
+		if remaining > timeout:
+			time.sleep(timeout)
+			return []
+
+		time.sleep(max(0, remaining))
+		self._next_poll = time.monotonic() + self._interval
+		changes = []
+		for path, mtime in list(self._paths.items()):
+			current = self._get_mtime(path)
+			if current != mtime:
+				self._paths[path] = current
+				changes.append((path, None))
+		return changes
+
+	def close(self): self._paths.clear()
+
+class LibraryWatcher:
+	"""
+	 Background thread that watches directories for added, removed or renamed files
+	 Changes are collected until no new changes happened for 'debounce_time' seconds (or 'max_delay' seconds passed since the first change),
+	 after which the callback is called once for every changed directory with the set of changed filenames (or None when the full directory must be checked)
+	"""
+	debounce_time = 0.5
+	max_delay = 5
+	poll_interval = 5
+
+	def __init__(self, callback):
+		self._callback = callback
+		self._backend = self._create_backend()
+		self._active = True
+		self._thread = threading.Thread(name="LibraryWatcher", target=self._run, daemon=True)
+		self._thread.start()
+
+	def _create_backend(self):
+		if sys.platform.startswith("linux"):
+			try:
+				backend = _InotifyBackend()
+				print("VERBOSE", "Watching library directories using inotify")
+				return backend
+			except (OSError, AttributeError, TypeError) as e: print("INFO", "Inotify not available, falling back to polling:", e)
+		print("VERBOSE", f"Watching library directories by polling every {self.poll_interval}s")
+		return _PollingBackend(self.poll_interval)
+
+	@property
+	def running(self): return self._thread.is_alive()
+
+	def watch(self, path):
+		""" Start watching given directory, has no effect if the directory cannot be watched """
+		try: self._backend.add(path)
+		except OSError as e: print("WARNING", f"Cannot watch '{path}' for changes:", e)
+
+	def unwatch(self, path):
+		""" Stop watching given directory """
+		self._backend.remove(path)
+
+	def stop(self):
+		""" Stop the watcher thread, any changes that were not processed yet are ignored """
+		self._active = False
+		self._thread.join(self.debounce_time * 4)
+
+	def _run(self):
+		pending = {}
+		first_change = last_change = 0
+		try:
+			while self._active:
+				changes = self._backend.wait(self.debounce_time)
+				now = time.monotonic()
+				if changes:
+					if not pending: first_change = now
+					last_change = now
+					for path, name in changes:
+						if name is None: pending[path] = None
+						elif pending.get(path, ()) is not None: pending.setdefault(path, set()).add(name)
+
+				if pending and (now - last_change >= self.debounce_time or now - first_change >= self.max_delay):
+					batch, pending = pending, {}
+					for path, names in batch.items():
+						try: self._callback(path, names)
+						except Exception as e: print("ERROR", f"Updating library for '{path}':", e)
+		finally: self._backend.close()
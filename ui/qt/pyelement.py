@@ -1276,9 +1276,74 @@ class PyProgessbar(PyElement):
         PyElement._on_mouse_press(self, event)
 
 
+class PyListModel(QtCore.QAbstractListModel):
+    """
+     List model that keeps the items shown in a list and only converts an item to its text when the view asks for it
+     The view is notified of every change separately, so only the rows that changed are redrawn
+        Keywords: display: function that returns the text for an item
+    """
+    def __init__(self, items=None, display=str):
+        QtCore.QAbstractListModel.__init__(self)
+        self._items = list(items) if items is not None else []
+        self._display = display
+
+    # QAbstractListModel overrides
+    def rowCount(self, parent=QtCore.QModelIndex()): return 0 if parent.isValid() else len(self._items)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and index.isValid() and 0 <= index.row() < len(self._items): return self._display(self._items[index.row()])
+        return None
+
+    @property
+    def items(self):
+        """ The items in this model, this list must not be modified """
+        return self._items
+
+    def text(self, row):
+        """ Returns the text displayed for the item in given row """
+        return self._display(self._items[row])
+
+    def set_items(self, items, display=None):
+        """ Replace all items in this model """
+        self.beginResetModel()
+        self._items = list(items)
+        if display is not None: self._display = display
+        self.endResetModel()
+
+    def update_row(self, row):
+        """ Redraw the row at given index, call this after the text of its item changed """
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole])
+
+    def set_item(self, row, item):
+        """ Replace the item in given row """
+        self._items[row] = item
+        self.update_row(row)
+
+    def insert_item(self, row, item):
+        """ Insert a new item before given row """
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._items.insert(row, item)
+        self.endInsertRows()
+
+    def remove_item(self, row):
+        """ Remove the item in given row, returns the removed item """
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        item = self._items.pop(row)
+        self.endRemoveRows()
+        return item
+
+    def move_item(self, row, destination):
+        """ Move the item in given row so it ends up in the destination row """
+        if row == destination: return
+        # Qt expects the row the item is placed before, when moving down this is the row after the destination
+        if not self.beginMoveRows(QtCore.QModelIndex(), row, row, QtCore.QModelIndex(), destination + 1 if destination > row else destination): return
+        self._items.insert(destination, self._items.pop(row))
+        self.endMoveRows()
+
 class PyItemlist(PyElement):
     """
      Show a list of items the user can select
+     The items can be strings set through 'itemlist', or any object with a function that returns the text for it through 'set_items'
      Interaction event fires when an item is left clicked, updating the selection
         Keywords: current: int -> the newly selected index, previous: int -> the previously selected index
     """
@@ -1296,19 +1361,27 @@ class PyItemlist(PyElement):
             QListView {{ 
              selection-background-color: #101010; selection-color: {self.qt_element.palette().highlight().color().name()}
             }} """)
-        self._items = QtCore.QStringListModel()
+        self._items = PyListModel()
+        self.qt_element.setModel(self._items)
 
     @property
     def qt_element(self) -> QtWidgets.QListView: return self._qt
 
     @property
-    def itemlist(self): return self._items.stringList()
+    def model(self) -> PyListModel:
+        """ The model containing the items of this list, use this to update single items """
+        return self._items
+
+    @property
+    def itemlist(self): return [self._items.text(row) for row in range(len(self._items.items))]
     @itemlist.setter
-    def itemlist(self, items):
-        self._items.setStringList(items)
-        self.qt_element.setModel(self._items)
+    def itemlist(self, items): self._items.set_items(items, str)
     value = itemlist
 
+    def set_items(self, items, display=str):
+        """ Replace all items in this list, the text for an item is only requested from 'display' when it is shown """
+        self._items.set_items(items, display)
+
     _selection_modes = {
         "none": QtWidgets.QListView.NoSelection,
         "single": QtWidgets.QListView.SingleSelection,
@@ -1375,7 +1448,7 @@ class PyItemlist(PyElement):
     def selected_item(self):
         """ Returns the string of the currently selected item, or None if nothing was selected """
         index = self.selected_index
-        try: return self.itemlist[index]
+        try: return self._items.text(index) if index >= 0 else None
         except IndexError: return None
     @selected_item.setter
     def selected_item(self, item):